@@ -1,14 +1,20 @@
 import logging
 import asyncio
+import time
 
+from typing import Optional
 from world import Controller, Action, Idle
 
 from .database import Database
+from .interpreter import StepInterpreter
 from .prompt import Prompt
+from .scheduler import agent
 
 class AIController(Controller):
-    def __init__(self, db: Database, prompt: Prompt, goal: str, flag: list[bool]):
+    def __init__(self, db: Database, prompt: Prompt, goal: str, flag: list[bool], interpret: bool = True):
+        """If interpret is True, simple plan steps are turned into actions without asking the prompt"""
         self.db = db
+        self.interpret = interpret
         self.prompt = prompt
         self.goal = goal
         self.flag = flag
@@ -16,53 +22,156 @@ class AIController(Controller):
         self.plan = []
         self.next_action_task = None
         self.just_started = True
+        self.error = ""
+        self.idle_since = 0.0
+
+        # Execute step started ahead of time, either for the next task of the plan while the current action still runs,
+        # or for the first task of a plan which is still being streamed
+        self.speculation = None
+
+    def prepare(self, world, character_id: str):
+        super().prepare(world, character_id)
+        self.interpreter = StepInterpreter(world)
+
+    async def async_execute(self, plan: list[str]) -> tuple[object, Action]:
+        """Picks the action which performs the first task of the given plan"""
+        if self.interpret:
+            action = self.interpreter.interpret(plan[0], self.character.inventory)
+            if action is not None:
+                logging.info(f"'{self.character_id}' interpreted '{plan[0]}' as {action}")
+                return self.prompt.executed(plan, action), action
+        return await self.prompt.execute(
+            context=await self.db.query(plan[0]),
+            inventory=self.character.inventory,
+            plan=plan)
+
+    async def async_speculate(self, plan: list[str], since: float) -> tuple[object, Action]:
+        agent.set((self.character_id, since))
+        return await self.async_execute(plan)
+
+    def speculate(self, plan: list[str], since: float):
+        """Starts executing the first task of the given plan, which is expected to become the character's plan"""
+        self.discard_speculation()
+        task = asyncio.create_task(self.async_speculate(plan, since))
+        self.speculation = (plan, set(self.character.inventory), task)
+
+    def speculate_next(self):
+        """Starts executing the next task of the plan, assuming the current action will succeed"""
+        if len(self.plan) > 1:
+            self.speculate(self.plan[1:], time.monotonic())
+        else:
+            self.discard_speculation()
+
+    def first_task(self, task: str):
+        """Called with the first task of a plan which is still being generated"""
+        self.speculate([task], self.idle_since)
+
+    def discard_speculation(self):
+        if self.speculation is not None:
+            task = self.speculation[2]
+            if task.done() and not task.cancelled():
+                # Retrieve the exception, if there's any, so that it isn't reported as unhandled
+                task.exception()
+            task.cancel()
+            self.speculation = None
+
+    async def speculated(self, plan: list[str]) -> Optional[tuple[object, Action]]:
+        """Returns the speculated execute step for the given plan, if it's still valid.
+        Only the first task of the plan has to match, as that's the one the execute step performs"""
+        if self.speculation is None:
+            return None
+        speculated_plan, inventory, task = self.speculation
+        self.speculation = None
+        if speculated_plan[0] != plan[0] or inventory != self.character.inventory:
+            # The action changed what the character has, so the speculated step may be wrong
+            self.speculation = (speculated_plan, inventory, task)
+            self.discard_speculation()
+            return None
+        try:
+            return await task
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            logging.warning(f"'{self.character_id}' failed to speculate its next action: {e}")
+            return None
 
     async def async_next_action(self, error: str = "") -> Action:
+        agent.set((self.character_id, self.idle_since))
         if self.flag[0]:
             logging.info(f"'{self.character_id}'s goal '{self.goal}' fulfilled!")
             return Idle(win=True)
 
+        # The state is only updated once everything succeeded, so that the task can be retried after a timeout
         if self.just_started:
-            self.just_started = False
-
-            self.plan = await self.prompt.plan(
+            plan = await self.prompt.plan(
                 context=await self.db.query(self.goal),
                 inventory=self.character.inventory,
-                goal=self.goal)
-            logging.info(f"'{self.character_id}'s initial plan: {self.plan}")
+                goal=self.goal,
+                first_task=self.first_task)
+            logging.info(f"'{self.character_id}'s initial plan: {plan}")
         else:
+            plan = self.plan
             if error:
-                self.plan = await self.prompt.reevaluate(
+                plan = await self.prompt.reevaluate(
                     context=await self.db.query(self.goal, error),
                     memory=self.memory,
-                    plan=self.plan,
+                    plan=plan,
                     goal=self.goal,
-                    error=error)
-            elif self.plan:
-                self.plan.pop(0)
+                    error=error,
+                    first_task=self.first_task)
+            elif plan:
+                plan = plan[1:]
 
-            if not self.plan:
-                self.plan = await self.prompt.reevaluate(
+            if not plan:
+                plan = await self.prompt.reevaluate(
                     context=await self.db.query(self.goal),
                     memory=self.memory,
-                    plan=self.plan,
-                    goal=self.goal)
+                    plan=plan,
+                    goal=self.goal,
+                    first_task=self.first_task)
 
-            logging.info(f"'{self.character_id}'s new plan: {self.plan}")
+            logging.info(f"'{self.character_id}'s new plan: {plan}")
 
-        self.memory, action = await self.prompt.execute(
-            context=await self.db.query(self.plan[0]),
-            inventory=self.character.inventory,
-            plan=self.plan)
+        # Speculations made before an error were discarded, so any speculation left was made for this plan
+        speculated = await self.speculated(plan)
+        if speculated is None:
+            memory, action = await self.async_execute(plan)
+        else:
+            memory, action = speculated
+        self.just_started = False
+        self.plan = plan
+        self.memory = memory
         return action
 
     def next_action(self, error: str = "") -> Action:
         if self.next_action_task is None:
-            self.next_action_task = asyncio.create_task(self.async_next_action(error))
+            if error:
+                self.discard_speculation()
+            # An error which was being handled when the previous attempt timed out is handled again
+            self.error = error or self.error
+            self.idle_since = self.idle_since or time.monotonic()
+            self.next_action_task = asyncio.create_task(self.async_next_action(self.error))
 
         if self.next_action_task.done():
-            result = self.next_action_task.result()
-            self.next_action_task = None
-            return result
+            task, self.next_action_task = self.next_action_task, None
+            if task.cancelled():
+                return Idle(True)
+            if isinstance(task.exception(), asyncio.TimeoutError):
+                # Slow database or prompt, try again on the next tick
+                logging.warning(f"'{self.character_id}' timed out while deciding its next action")
+                return Idle(True)
+            self.error = ""
+            self.idle_since = 0.0
+            action = task.result()
+            if not isinstance(action, Idle):
+                self.speculate_next()
+            return action
         else:
             return Idle(True)
+
+    def cancel(self):
+        """Cancels the pending next action, along with any database or prompt requests it is waiting on"""
+        if self.next_action_task is not None:
+            self.next_action_task.cancel()
+            self.next_action_task = None
+        self.discard_speculation()
@@ -0,0 +1,73 @@
+import asyncio
+
+from typing import Callable, Optional
+from world import Action
+
+from .prompt import Prompt
+
+class BatchedPrompt(Prompt):
+    """Prompt which collects the plan and reevaluate requests made within a short window, and answers each kind
+    together with plan_many and reevaluate_many. execute goes straight to the wrapped prompt"""
+
+    def __init__(self, prompt: Prompt, window: float = 0.05, size: int = 8):
+        """Requests are held for up to window seconds, or until size of them are pending"""
+        self.prompt = prompt
+        self.window = window
+        self.size = size
+        self.pending = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # The event loop only keeps weak references to tasks
+        self.tasks = set[asyncio.Task]()
+
+    async def plan(self, context: list[str], inventory: set[str], goal: str, first_task: Optional[Callable[[str], None]] = None) -> list[str]:
+        return await self.__queue("plan", (context, set(inventory), goal), first_task)
+
+    async def execute(self, context: list[str], inventory: set[str], plan: list[str]) -> tuple[object, Action]:
+        return await self.prompt.execute(context, inventory, plan)
+
+    async def reevaluate(self, context: list[str], memory: object, plan: list[str], goal: str, error: str = "", first_task: Optional[Callable[[str], None]] = None) -> list[str]:
+        return await self.__queue("reevaluate", (context, memory, list(plan), goal, error), first_task)
+
+    def executed(self, plan: list[str], action: Action) -> object:
+        return self.prompt.executed(plan, action)
+
+    async def __queue(self, kind: str, request: tuple, first_task: Optional[Callable[[str], None]]) -> list[str]:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((kind, request, first_task, future))
+        if len(self.pending) >= self.size:
+            self.__flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.__flush)
+        return await future
+
+    def __flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending = [request for request in self.pending if not request[3].done()]
+        self.pending = []
+        for kind in ("plan", "reevaluate"):
+            batch = [request for request in pending if request[0] == kind]
+            if batch:
+                task = asyncio.ensure_future(self.__answer(kind, batch))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def __answer(self, kind: str, batch: list):
+        alone, many = (self.prompt.plan, self.prompt.plan_many) if kind == "plan" else (self.prompt.reevaluate, self.prompt.reevaluate_many)
+        try:
+            if len(batch) == 1:
+                # A lone request can still stream its first task
+                _, request, first_task, _ = batch[0]
+                plans = [await alone(*request, first_task=first_task)]
+            else:
+                plans = await many([request for _, request, _, _ in batch])
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (*_, future), plan in zip(batch, plans):
+            if not future.done():
+                future.set_result(plan)
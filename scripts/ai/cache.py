@@ -0,0 +1,63 @@
+import hashlib
+import sqlite3
+
+from collections import OrderedDict
+from typing import Optional
+
+def digest(*parts: str) -> str:
+    """Returns a key which identifies the given contents"""
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+class Cache:
+    """LRU cache kept in memory, optionally backed by a SQLite file so that entries survive between runs"""
+
+    def __init__(self, table: str, path: Optional[str] = None, capacity: int = 4096):
+        self.table = table
+        self.capacity = capacity
+        self.entries = OrderedDict[str, bytes]()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB)")
+            self.conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value stored for the given key, or None if there's none"""
+        value = self.entries.get(key)
+        if value is None and self.conn is not None:
+            row = self.conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = row[0]
+                self.__remember(key, value)
+
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        """Stores a value for the given key"""
+        self.put_many([(key, value)])
+
+    def put_many(self, items: list[tuple[str, bytes]]):
+        """Stores several key and value pairs at once"""
+        for key, value in items:
+            self.__remember(key, value)
+        if self.conn is not None:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", items)
+            self.conn.commit()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __remember(self, key: str, value: bytes):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
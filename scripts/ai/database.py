@@ -1,8 +1,35 @@
+import asyncio
 import openai
 import os
+import re
+import numpy as np
 import singlestoredb as s2
-from typing import Optional
-from world import World
+import tiktoken
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+from world import World, Change, Object, ObjectAdded, ObjectRemoved
+
+from .cache import Cache, digest
+from .index import IVFIndex
+from .pool import ConnectionPool
+
+Embed = Callable[[list[str], str], Awaitable[list[list[float]]]]
+
+async def openai_embed(texts: list[str], model: str) -> list[list[float]]:
+    """Returns the vectors for semantic search of the given texts, using the OpenAI embedding API"""
+    result = await openai.Embedding.acreate(input=texts, model=model)
+    return [data["embedding"] for data in sorted(result["data"], key=lambda data: data["index"])] # type: ignore
+
+async def stub_embed(texts: list[str], model: str) -> list[list[float]]:
+    """Local stand-in for openai_embed, which hashes the words of each text into a normalized vector"""
+    vectors = []
+    for text in texts:
+        vector = np.zeros(1536, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(digest(word)[:8], 16) % vector.size] += 1.0
+        norm = np.linalg.norm(vector)
+        vectors.append((vector / norm if norm else vector).tolist())
+    return vectors
 
 class Database():
     """Interface for the database which stores the context used by the AI.
@@ -12,6 +39,20 @@ class Database():
     - characters.
     """
 
+    @staticmethod
+    def object_fact(id: str, obj: Object) -> str:
+        """Returns the context which describes the given object"""
+        return f"There is a '{obj.type}' named '{id}'."
+
+    @staticmethod
+    def facts(world: World) -> list[str]:
+        """Returns the context which describes the given world"""
+        context = []
+        context += list(map(lambda x: x.rule(), world.interactions.values()))
+        context += list(map(Database.object_fact, world.objects.keys(), world.objects.values()))
+        #context += list(map(lambda id: f"There is a character named '{id}'.", world.characters.keys()))
+        return context
+
     async def fill(self, world: World):
         """Fills the database with data from the given world"""
         raise NotImplementedError()
@@ -32,10 +73,7 @@ class DumbDatabase(Database):
     async def query(self, task: str, error: Optional[str] = None) -> list[str]:
         assert self.world is not None, "Database must be filled before querying"
 
-        context = []
-        context += list(map(lambda x: x.rule(), self.world.interactions.values()))
-        context += list(map(lambda id, x: f"There is a '{x.type}' named '{id}'.", self.world.objects.keys(), self.world.objects.values()))
-        #context += list(map(lambda id: f"There is a character named '{id}'.", self.world.characters.keys()))
+        context = self.facts(self.world)
 
         print()
         print(f"Context queried from task '{task}' and error {error}")
@@ -45,8 +83,143 @@ class DumbDatabase(Database):
 
         return context
 
-class SingleStoreDatabase(Database):
-    """Database which uses SingleStore as a backend"""
+class EmbeddingDatabase(Database):
+    """Base for databases which rank the context by the similarity of its embeddings to the task"""
+
+    def __init__(self,
+                 encoding: str,
+                 model: str,
+                 cache: Optional[Cache] = None,
+                 embed: Embed = openai_embed,
+                 batch_tokens: Optional[int] = None,
+                 batch_size: int = 2048,
+                 concurrency: int = 4):
+        """Embeddings are looked up in the given cache before being requested with embed.
+        Missing embeddings are requested in batches of at most batch_size texts and batch_tokens tokens,
+        with up to concurrency requests in flight at once.
+        By default, only openai_embed has a token limit, of 8000: texts are only tokenized when there's a limit,
+        so other embedders, such as stub_embed, never need to load the encoding"""
+        self._encoding = encoding
+        self._model = model
+        self._cache = cache if cache is not None else Cache("embeddings")
+        self._embed = embed
+        self._batch_tokens = batch_tokens if batch_tokens is not None else 8000 if embed is openai_embed else None
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._semaphores = dict[asyncio.AbstractEventLoop, asyncio.Semaphore]()
+        self._tokenizer = None
+        self._pending = dict[str, bool]()
+
+    def listen(self, world: World):
+        """Starts tracking the changes made to the given world, dropping the ones queued before"""
+        self._pending.clear()
+        world.listen(self.changed)
+
+    def changed(self, change: Change):
+        """Queues the context affected by the given change, to be applied before the next query"""
+        if isinstance(change, ObjectAdded):
+            self._pending[self.object_fact(change.id, change.object)] = True
+        elif isinstance(change, ObjectRemoved):
+            self._pending[self.object_fact(change.id, change.object)] = False
+        # Inventories aren't part of the context, they are given to the prompts directly
+
+    async def update(self):
+        """Applies the changes queued since the last update"""
+        if self._pending:
+            pending, self._pending = self._pending, dict[str, bool]()
+            try:
+                await self.apply([ctx for ctx, present in pending.items() if present],
+                                 [ctx for ctx, present in pending.items() if not present])
+            except BaseException:
+                # Retry on the next update, unless newer changes were queued in the meantime
+                self._pending = pending | self._pending
+                raise
+
+    async def apply(self, added: list[str], removed: list[str]):
+        """Adds and removes the given contexts"""
+        raise NotImplementedError()
+
+    def count_tokens(self, text: str) -> int:
+        """Returns how many tokens the given text is encoded into"""
+        if self._tokenizer is None:
+            self._tokenizer = tiktoken.get_encoding(self._encoding)
+        return len(self._tokenizer.encode(text))
+
+    def batches(self, texts: list[str]) -> list[list[str]]:
+        """Splits the given texts into consecutive batches which fit in a single embedding request"""
+        batches = []
+        batch = []
+        tokens = 0
+        for text in texts:
+            count = self.count_tokens(text) if self._batch_tokens is not None else 0
+            if batch and (len(batch) == self._batch_size or (self._batch_tokens is not None and tokens + count > self._batch_tokens)):
+                batches.append(batch)
+                batch = []
+                tokens = 0
+            batch.append(text)
+            tokens += count
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def embed_batch(self, batch: list[str]) -> list[list[float]]:
+        """Requests the embeddings of a single batch, waiting for a free request slot"""
+        # Semaphores can't be shared between event loops, and the database is filled from a different one
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores = {loop: asyncio.Semaphore(self._concurrency)}
+        async with self._semaphores[loop]:
+            embeddings = await self._embed(batch, self._model)
+        assert len(embeddings) == len(batch), f"Expected {len(batch)} embeddings, got {len(embeddings)}"
+        return embeddings
+
+    async def get_embedding(self, text):
+        """Returns the vector for semantic search, from the cache or using the embedding function"""
+        return (await self.get_embeddings([text]))[0]
+
+    async def get_embeddings(self, vector):
+        """get_embedding but mapped to a vector of inputs"""
+        return [np.frombuffer(packed, dtype=np.float32).tolist() for packed in await self.get_packed_embeddings(vector)]
+
+    async def get_packed_embeddings(self, vector) -> list[bytes]:
+        """Returns the embeddings of the given texts packed as float32 arrays. Only the texts missing from the cache
+        are embedded, in batches which are requested concurrently"""
+        keys = [digest(self._model, text) for text in vector]
+        found = dict[str, bytes]()
+        missing = dict[str, str]()
+        for key, text in zip(keys, vector):
+            if key not in found and key not in missing:
+                cached = self._cache.get(key)
+                if cached is None:
+                    missing[key] = text
+                else:
+                    found[key] = cached
+
+        batches = self.batches(list(missing.values()))
+        results = await asyncio.gather(*map(self.embed_batch, batches))
+        embeddings = [embedding for result in results for embedding in result]
+        for key, embedding in zip(missing.keys(), embeddings):
+            found[key] = np.array(embedding, dtype=np.float32).tobytes()
+        self._cache.put_many([(key, found[key]) for key in missing])
+
+        return [found[key] for key in keys]
+
+    @staticmethod
+    def query_text(task: str, error: Optional[str] = None) -> str:
+        """Returns the text whose embedding is compared against the context"""
+        return task + ("" if error is None else " " + error)
+
+    @staticmethod
+    def print_context(task: str, error: Optional[str], context: list[str]):
+        print()
+        print(f"Context queried from task '{task}' and error {error}")
+        for ctx in context:
+            print(f" - {ctx}")
+        print()
+
+class SingleStoreDatabase(EmbeddingDatabase):
+    """Database which uses SingleStore as a backend.
+    The blocking driver calls run on a dedicated thread pool, so they don't stall the event loop"""
 
     def __init__(self,
                  encoding: str,
@@ -55,40 +228,91 @@ class SingleStoreDatabase(Database):
                  port: int,
                  user: str,
                  password: str,
-                 database: str):
-        self._encoding = encoding
-        self._model = model
-        self._conn = s2.connect(host=host, port=port, user=user, password=password, database=database)
+                 database: str,
+                 cache: Optional[Cache] = None,
+                 embed: Embed = openai_embed,
+                 pool_size: int = 4,
+                 chunk_size: int = 1000,
+                 timeout: float = 10,
+                 write_timeout: Optional[float] = None):
+        """Up to pool_size connections are opened to the database, and rows are inserted chunk_size at a time.
+        Queries taking longer than timeout seconds raise asyncio.TimeoutError, as do writes taking longer than
+        write_timeout seconds, if given: filling a large world in chunks can take much longer than a query"""
+        super().__init__(encoding, model, cache, embed)
+        self._pool = ConnectionPool(lambda: s2.connect(host=host, port=port, user=user, password=password, database=database), pool_size)
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix="singlestore")
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+        self._write_timeout = write_timeout
 
         self.filled = False
         self._id = -1
+        self._rows = dict[str, int]()
 
     def new_id(self):
         self._id += 1
         return self._id
 
-    async def get_embedding(self, text):
-        """Returns the vector for semantic search, using the OpenAI embedding API"""
-        return (await openai.Embedding.acreate(input=[text], model=self._model))["data"][0]["embedding"] # type: ignore
-
-    async def get_embeddings(self, vector):
-        """get_embedding but mapped to a vector of inputs"""
-        result = []
-        for text in vector:
-            result.append(await self.get_embedding(text))
-        return result
+    async def run(self, function: Callable, *args, write: bool = False):
+        """Calls the given blocking function on the database's thread pool, with the timeout of writes if write is set.
+        If the caller is cancelled or times out, the call is abandoned and finishes in the background"""
+        loop = asyncio.get_running_loop()
+        timeout = self._write_timeout if write else self._timeout
+        return await asyncio.wait_for(loop.run_in_executor(self._executor, function, *args), timeout)
 
     async def fill(self, world: World):
         """Fills the database with data from the given world"""
 
         print("Filling database...")
 
-        context = []
-        context += list(map(lambda x: x.rule(), world.interactions.values()))
-        context += list(map(lambda id, x: f"There is a '{x.type}' named '{id}'.", world.objects.keys(), world.objects.values()))
-        #context += list(map(lambda id: f"There is a character named '{id}'.", world.characters.keys()))
+        self.listen(world)
+        self._rows.clear()
+        context = list(dict.fromkeys(self.facts(world)))
+        rows = await self.rows(context)
+        await self.run(self.__reset_table, rows, write=True)
+
+        self.filled = True
+        print("Database filled")
+
+    async def rows(self, context: list[str]) -> list[tuple[int, str, bytes]]:
+        """Returns the rows storing the given contexts. Each context keeps its id, so that rows can be written again safely"""
+        rows = []
+        for ctx, vector in zip(context, await self.get_packed_embeddings(context)):
+            if ctx not in self._rows:
+                self._rows[ctx] = self.new_id()
+            rows.append((self._rows[ctx], ctx, vector))
+        return rows
+
+    async def apply(self, added: list[str], removed: list[str]):
+        """Adds and removes the rows of the given contexts"""
+        ids = [self._rows[ctx] for ctx in removed if ctx in self._rows]
+        rows = await self.rows(added)
+        await self.run(self.__write, ids, rows, write=True)
+        for ctx in removed:
+            self._rows.pop(ctx, None)
 
-        with self._conn.cursor() as cursor:
+    async def query(self, task: str, error: Optional[str] = None) -> list[str]:
+        """Queries context for the given task, optionally with the error message of the previous action if it failed"""
+        assert self.filled, "Database must be filled before querying"
+
+        await self.update()
+        goal_vector = (await self.get_packed_embeddings([self.query_text(task, error)]))[0]
+
+        context_filtered = []
+
+        results = await self.run(self.__select, goal_vector)
+
+        for row in results:
+            _, filtered, _ = row # type: ignore
+            context_filtered += [
+                filtered,
+            ]
+
+        self.print_context(task, error, context_filtered)
+        return context_filtered
+
+    def __reset_table(self, rows: list[tuple[int, str, bytes]]):
+        with self._pool.connection() as conn, conn.cursor() as cursor:
             cursor.execute(
                     """
                     CREATE TABLE IF NOT EXISTS info(
@@ -99,45 +323,143 @@ class SingleStoreDatabase(Database):
                     """
             )
             cursor.execute("DELETE FROM info;")
+            self.__insert(cursor, rows)
 
-            query = """INSERT INTO info VALUES """
-            for ctx, vector in zip(context, await self.get_embeddings(context)):
-                query += f"""({self.new_id()}, "{ctx}", JSON_ARRAY_PACK('{vector}')),"""
-            query = query[:-1] + ";"
-            cursor.execute(query)
+    def __write(self, ids: list[int], rows: list[tuple[int, str, bytes]]):
+        with self._pool.connection() as conn, conn.cursor() as cursor:
+            for i in range(0, len(ids), self._chunk_size):
+                chunk = ids[i:i + self._chunk_size]
+                cursor.execute(f"DELETE FROM info WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+            self.__insert(cursor, rows)
 
-        self.filled = True
-        print("Database filled")
+    def __insert(self, cursor, rows: list[tuple[int, str, bytes]]):
+        for i in range(0, len(rows), self._chunk_size):
+            cursor.executemany("REPLACE INTO info (id, context, vector) VALUES (%s, %s, %s)", rows[i:i + self._chunk_size])
 
-    async def query(self, task: str, error: Optional[str] = None) -> list[str]:
-        """Queries context for the given task, optionally with the error message of the previous action if it failed"""
-        assert self.filled, "Database must be filled before querying"
-
-        goal_vector = await self.get_embedding(task + ("" if error is None else " " + error))
-
-        context_filtered = []
-
-        with self._conn.cursor() as cursor:
+    def __select(self, vector: bytes) -> list:
+        with self._pool.connection() as conn, conn.cursor() as cursor:
             cursor.execute(
-                f"""
-                    SELECT id, context, dot_product(vector, JSON_ARRAY_PACK('{goal_vector}')) AS score
+                """
+                    SELECT id, context, dot_product(vector, %s) AS score
                     FROM info
                     ORDER BY score DESC
                     LIMIT 10;
-                """
+                """,
+                (vector,)
             )
-            results = cursor.fetchall()
+            return cursor.fetchall()
 
-        for row in results:
-            _, filtered, _ = row # type: ignore
-            context_filtered += [
-                filtered,
-            ]
+class LocalDatabase(EmbeddingDatabase):
+    """Database which keeps the embeddings in memory, in a contiguous matrix with one row per context"""
 
-        print()
-        print(f"Context queried from task '{task}' and error {error}")
-        for ctx in context_filtered:
-            print(f" - {ctx}")
-        print()
+    def __init__(self,
+                 encoding: str,
+                 model: str,
+                 cache: Optional[Cache] = None,
+                 embed: Embed = openai_embed,
+                 limit: int = 10,
+                 index: Optional[IVFIndex] = None,
+                 index_path: Optional[str] = None):
+        """limit is how many contexts are returned by each query.
+        If an index is given, queries are answered approximately by it, instead of by scanning every context.
+        If an index_path is also given, the index is saved there once it's trained, and the centroids saved by
+        a previous run are reused instead of training them again, as long as they have as many lists"""
+        super().__init__(encoding, model, cache, embed)
+        self.limit = limit
+        self.index = index
+        self.index_path = index_path
+        if index is not None and index_path and os.path.exists(index_path):
+            saved = IVFIndex.load(index_path)
+            if saved.nlist == index.nlist:
+                saved.nprobe = index.nprobe
+                self.index = saved
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.context = list[str]()
+        self.rows = dict[str, int]()
+        self.filled = False
 
-        return context_filtered
+    async def fill(self, world: World):
+        """Fills the database with data from the given world"""
+        self.listen(world)
+        self.remove(self.context.copy())
+        if self.index is not None:
+            # Vectors saved with the index belong to the rows of a previous run
+            self.index.clear()
+        await self.add(self.facts(world))
+        self.filled = True
+
+    async def apply(self, added: list[str], removed: list[str]):
+        self.remove(removed)
+        await self.add(added)
+
+    async def add(self, context: list[str]):
+        """Adds the given contexts to the database, skipping the ones already in it"""
+        context = [ctx for ctx in dict.fromkeys(context) if ctx not in self.rows]
+        if not context:
+            return
+        vectors = np.frombuffer(b"".join(await self.get_packed_embeddings(context)), dtype=np.float32).reshape(len(context), -1)
+
+        count = len(self.context)
+        if self.matrix.shape[1] != vectors.shape[1]:
+            assert count == 0, "All embeddings must have the same dimension"
+            self.matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        if count + len(context) > self.matrix.shape[0]:
+            # Grow geometrically, so that adding one context at a time doesn't copy the whole matrix every time
+            grown = np.zeros((max(count + len(context), 2 * self.matrix.shape[0]), vectors.shape[1]), dtype=np.float32)
+            grown[:count] = self.matrix[:count]
+            self.matrix = grown
+
+        self.matrix[count:count + len(context)] = vectors
+        for ctx in context:
+            self.rows[ctx] = len(self.context)
+            self.context.append(ctx)
+        if self.index is not None:
+            trained = self.index.trained
+            self.index.add(list(range(count, count + len(context))), vectors)
+            if self.index_path and self.index.trained and not trained:
+                self.index.save(self.index_path)
+
+    def remove(self, context: list[str]):
+        """Removes the given contexts from the database, ignoring the ones which aren't in it"""
+        for ctx in context:
+            row = self.rows.pop(ctx, None)
+            if row is None:
+                continue
+
+            # Move the last row into the hole, so that the used rows stay contiguous
+            last = len(self.context) - 1
+            if row != last:
+                self.matrix[row] = self.matrix[last]
+                self.context[row] = self.context[last]
+                self.rows[self.context[row]] = row
+            self.context.pop()
+            if self.index is not None:
+                self.index.remove([last])
+                if row != last:
+                    self.index.add([row], self.matrix[row])
+
+    def search(self, vector: np.ndarray) -> list[str]:
+        """Returns the contexts most similar to the given vector, most similar first"""
+        count = len(self.context)
+        if count == 0:
+            return []
+        if self.index is not None:
+            return [self.context[row] for row in self.index.search(vector, self.limit)]
+        scores = self.matrix[:count] @ vector
+        if count > self.limit:
+            best = np.argpartition(scores, -self.limit)[-self.limit:]
+        else:
+            best = np.arange(count)
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [self.context[i] for i in best]
+
+    async def query(self, task: str, error: Optional[str] = None) -> list[str]:
+        """Queries context for the given task, optionally with the error message of the previous action if it failed"""
+        assert self.filled, "Database must be filled before querying"
+
+        await self.update()
+        vector = np.frombuffer((await self.get_packed_embeddings([self.query_text(task, error)]))[0], dtype=np.float32)
+        context = self.search(vector)
+
+        self.print_context(task, error, context)
+        return context
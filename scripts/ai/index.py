@@ -0,0 +1,178 @@
+import numpy as np
+
+from typing import Optional
+
+class IVFIndex:
+    """Approximate nearest neighbour index for inner product search, using an inverted file:
+    vectors are grouped into lists by their closest k-means centroid, and only the lists of the
+    nprobe centroids closest to the query are scanned.
+    Until there are enough vectors to train the centroids, every vector is kept in a single list,
+    which makes searches exact"""
+
+    def __init__(self, nlist: int = 256, nprobe: int = 8, train_size: Optional[int] = None, seed: int = 0):
+        """nlist is the number of centroids and nprobe how many of them are scanned per query:
+        a higher nprobe gives a better recall at the cost of latency.
+        The centroids are trained once train_size vectors have been added (by default, 39 per centroid)"""
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size if train_size is not None else 39 * nlist
+        self.rng = np.random.default_rng(seed)
+
+        self.dim = 0
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.ids = list[np.ndarray]()
+        self.vectors = list[np.ndarray]()
+        self.counts = list[int]()
+        self.where = dict[int, tuple[int, int]]()
+
+    @property
+    def trained(self) -> bool:
+        return len(self.centroids) > 0
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    def add(self, ids: list[int], vectors: np.ndarray):
+        """Adds the given vectors, identified by the given ids, replacing any vectors with the same ids"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if len(ids) == 0:
+            return
+        if self.dim == 0:
+            self.dim = vectors.shape[1]
+            self.__reset(1)
+        assert vectors.shape[1] == self.dim, f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}"
+
+        self.remove(ids)
+        self.__distribute(np.asarray(ids, dtype=np.int64), vectors)
+
+        if not self.trained and len(self) >= self.train_size:
+            self.train()
+
+    def remove(self, ids: list[int]):
+        """Removes the vectors with the given ids, ignoring the ones which aren't in the index"""
+        for id in np.asarray(ids, dtype=np.int64).tolist():
+            found = self.where.pop(id, None)
+            if found is None:
+                continue
+
+            # Move the last entry of the list into the hole
+            lst, pos = found
+            last = self.counts[lst] - 1
+            if pos != last:
+                moved = int(self.ids[lst][last])
+                self.ids[lst][pos] = moved
+                self.vectors[lst][pos] = self.vectors[lst][last]
+                self.where[moved] = (lst, pos)
+            self.counts[lst] = last
+
+    def clear(self):
+        """Removes every vector, keeping the trained centroids"""
+        if self.dim > 0:
+            self.__reset(max(1, len(self.centroids)))
+
+    def train(self, iterations: int = 10):
+        """Clusters the vectors in the index with spherical k-means, and redistributes them into the new lists"""
+        ids, vectors = self.__everything()
+        nlist = min(self.nlist, len(ids))
+        if nlist == 0:
+            return
+
+        sample = vectors[self.rng.choice(len(vectors), size=min(len(vectors), 64 * nlist), replace=False)]
+        centroids = sample[self.rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self.__closest(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            order = np.argsort(assignment, kind="stable")
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(sample[order], (np.cumsum(counts) - counts)[~empty])
+            # Clusters left empty are reseeded with random samples
+            sums[empty] = sample[self.rng.choice(len(sample), size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms > 0, norms, 1)
+
+        self.centroids = centroids.astype(np.float32)
+        self.__reset(nlist)
+        self.__distribute(ids, vectors)
+
+    def search(self, vector: np.ndarray, k: int) -> list[int]:
+        """Returns the ids of the (approximately) k vectors with the highest inner product with the given one, highest first"""
+        if len(self) == 0:
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+
+        if self.trained:
+            scores = self.centroids @ vector
+            probe = np.argpartition(scores, -self.nprobe)[-self.nprobe:] if self.nprobe < len(scores) else range(len(scores))
+        else:
+            probe = [0]
+
+        ids = np.concatenate([self.ids[lst][:self.counts[lst]] for lst in probe])
+        if len(ids) == 0:
+            return []
+        scores = np.concatenate([self.vectors[lst][:self.counts[lst]] @ vector for lst in probe])
+        best = np.argpartition(scores, -k)[-k:] if k < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return ids[best].tolist()
+
+    def save(self, path: str):
+        """Writes the index to the given file"""
+        ids, vectors = self.__everything()
+        # Through a file, so that np.savez doesn't append .npz to the path
+        with open(path, "wb") as file:
+            np.savez(file, nlist=self.nlist, nprobe=self.nprobe, train_size=self.train_size,
+                     centroids=self.centroids, ids=ids, vectors=vectors)
+
+    @staticmethod
+    def load(path: str) -> "IVFIndex":
+        """Reads an index written by save"""
+        with np.load(path) as data:
+            index = IVFIndex(int(data["nlist"]), int(data["nprobe"]), int(data["train_size"]))
+            index.centroids = data["centroids"]
+            if len(data["ids"]) > 0 or index.trained:
+                index.dim = data["vectors"].shape[1] if len(data["ids"]) > 0 else index.centroids.shape[1]
+                index.__reset(max(1, len(index.centroids)))
+                index.__distribute(data["ids"], data["vectors"])
+        return index
+
+    @staticmethod
+    def __closest(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 4096) -> np.ndarray:
+        return np.concatenate([np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1) for i in range(0, len(vectors), chunk)])
+
+    def __distribute(self, ids: np.ndarray, vectors: np.ndarray):
+        if not self.trained:
+            self.__extend(0, ids, vectors)
+            return
+        assignment = self.__closest(vectors, self.centroids)
+        for lst in np.unique(assignment):
+            mask = assignment == lst
+            self.__extend(int(lst), ids[mask], vectors[mask])
+
+    def __reset(self, nlist: int):
+        self.ids = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self.vectors = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self.counts = [0] * nlist
+        self.where.clear()
+
+    def __extend(self, lst: int, ids: np.ndarray, vectors: np.ndarray):
+        count = self.counts[lst]
+        if count + len(ids) > len(self.ids[lst]):
+            # Grow geometrically, so that inserting one vector at a time doesn't copy the whole list every time
+            capacity = max(16, 2 * len(self.ids[lst]), count + len(ids))
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_ids[:count] = self.ids[lst][:count]
+            grown_vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown_vectors[:count] = self.vectors[lst][:count]
+            self.ids[lst], self.vectors[lst] = grown_ids, grown_vectors
+        self.ids[lst][count:count + len(ids)] = ids
+        self.vectors[lst][count:count + len(ids)] = vectors
+        self.counts[lst] = count + len(ids)
+        for pos, id in enumerate(ids.tolist(), count):
+            self.where[id] = (lst, pos)
+
+    def __everything(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.dim == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        ids = np.concatenate([self.ids[lst][:count] for lst, count in enumerate(self.counts)])
+        vectors = np.concatenate([self.vectors[lst][:count] for lst, count in enumerate(self.counts)])
+        return ids, vectors
@@ -0,0 +1,87 @@
+import re
+
+from typing import Optional
+from world import World, Action, Walk, Interact
+
+# Rules of the form "You can <verb> a '<type>' with a '<item>'.", e.g. PickUp, Open and Win
+RULE = re.compile(r"You can (?P<verb>.+?) (?:an? )?'(?P<type>[^']+)' (?:with|using) (?:an? )?'(?P<item>[^']+)'\.?", re.IGNORECASE)
+
+WALK = re.compile(r"(?:walk|go|move|head)(?: back)?(?: over)? to(?:wards)? (?P<target>.+)", re.IGNORECASE)
+INTERACT = re.compile(r"interact with (?P<target>.+?) (?:using|with) (?P<item>.+)", re.IGNORECASE)
+USE = re.compile(r"use (?P<item>.+?) (?:on|with) (?P<target>.+)", re.IGNORECASE)
+GIVE = re.compile(r"give (?P<item>.+?) to (?P<target>.+)", re.IGNORECASE)
+ARTICLE = re.compile(r"^(?:the|an?|your)\s+", re.IGNORECASE)
+
+class StepInterpreter:
+    """Turns simple plan steps, such as "Walk to 'door'" or "Pick up 'key' with 'hand'", straight into actions,
+    by matching them against the ids in the world and the templates of its interaction rules.
+    Steps which don't match exactly one action are left for the model"""
+
+    def __init__(self, world: World):
+        self.world = world
+
+    def interpret(self, task: str, inventory: set[str]) -> Optional[Action]:
+        """Returns the action which performs the given task, or None if it isn't understood"""
+        task = task.strip().rstrip(".!").strip()
+
+        match = WALK.fullmatch(task)
+        if match:
+            target = self.target(match["target"])
+            return None if target is None else Walk(target)
+
+        for pattern in (INTERACT, USE, GIVE):
+            match = pattern.fullmatch(task)
+            if match:
+                target = self.target(match["target"])
+                item = self.item(match["item"], inventory)
+                if target is None or item is None:
+                    return None
+                if pattern is GIVE and target not in self.world.characters:
+                    return None
+                return Interact(item, target)
+
+        actions = set[tuple[str, str]]()
+        for interaction in self.world.interactions.values():
+            rule = RULE.fullmatch(interaction.rule())
+            if rule is None:
+                continue
+            match = re.fullmatch(re.escape(rule["verb"]) + r" (?P<target>.+?)(?: (?:with|using) (?P<item>.+))?", task, re.IGNORECASE)
+            if match is None:
+                continue
+            target = self.target(match["target"], rule["type"])
+            item = self.item(match["item"] or rule["item"], inventory)
+            if target is not None and item is not None and target in self.world.objects and self.world.objects[target].type == rule["type"]:
+                actions.add((item, target))
+
+        if len(actions) == 1:
+            return Interact(*actions.pop())
+        return None
+
+    @staticmethod
+    def name(text: str) -> str:
+        return ARTICLE.sub("", text.strip()).strip("'\"` ")
+
+    def target(self, text: str, type: Optional[str] = None) -> Optional[str]:
+        """Returns the id of the object or character named by the given text.
+        A type which only one object has also names that object"""
+        name = self.name(text)
+        if name in self.world.objects or name in self.world.characters:
+            return name
+
+        lowered = name.lower()
+        ids = [id for id in list(self.world.objects) + list(self.world.characters) if id.lower() == lowered]
+        if len(ids) == 1:
+            return ids[0]
+
+        ids = [id for id, obj in self.world.objects.items() if obj.type.lower() == lowered and (type is None or obj.type == type)]
+        if len(ids) == 1:
+            return ids[0]
+        return None
+
+    def item(self, text: str, inventory: set[str]) -> Optional[str]:
+        """Returns the item of the inventory named by the given text"""
+        name = self.name(text)
+        if name in inventory:
+            return name
+        items = [item for item in inventory if item.lower() == name.lower()]
+        return items[0] if len(items) == 1 else None
@@ -0,0 +1,40 @@
+import queue
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+class ConnectionPool:
+    """Hands out up to size connections at once, reusing the ones which were given back.
+    Safe to use from several threads"""
+
+    def __init__(self, connect: Callable[[], Any], size: int = 4):
+        """connect opens a new connection, and is only called when every open connection is busy"""
+        self.connect = connect
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrows a connection, waiting for one to be given back if size connections are already in use"""
+        with self.slots:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+
+            try:
+                yield conn
+            except BaseException:
+                # The connection may be left in a bad state, so it is not reused
+                conn.close()
+                raise
+            self.idle.put(conn)
+
+    def close(self):
+        """Closes every idle connection"""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
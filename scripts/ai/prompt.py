@@ -1,7 +1,12 @@
+import asyncio
+import itertools
 import openai
 import json
+import logging
+import re
+import tiktoken
 
-from typing import Union
+from typing import Awaitable, Callable, Optional, Union
 from world import Action, Walk, Interact, Ask
 from tenacity import (
     retry,
@@ -9,25 +14,185 @@ from tenacity import (
     wait_random_exponential,
 )
 
+from .cache import Cache, digest
+from .interpreter import RULE, WALK, INTERACT, StepInterpreter
+from .scheduler import Scheduler
+
 class Prompt():
     """Interface for the prompt used by the AI"""
 
+    # Completion tokens reserved for each request, before its actual usage is known
+    COMPLETION_TOKENS = 256
+    # For how long requests stop being made after the API rate limits one of them
+    RATE_LIMIT_PAUSE = 10
+
+    scheduler: Optional[Scheduler] = None
+    cache: Optional[Cache] = None
+    # Whether only completions made at temperature 0 are reused
+    deterministic_cache = True
+    # How many times each sampled request has been made, see completion
+    repeats: Optional[dict[str, int]] = None
+    # Whether only cached completions are used, failing requests which aren't cached instead of making them
+    replay = False
+    # Sampling seed sent with every request, which also separates the cached completions of different seeds
+    seed: Optional[int] = None
+
+    # Completions requested so far, how many of them came from the cache, and the tokens they used
+    calls = 0
+    cached_calls = 0
+    prompt_tokens = 0
+    completion_tokens = 0
+
+    @staticmethod
+    def cache_key(**kwargs) -> str:
+        """Returns the key under which the completion for the given request is cached"""
+        messages = [{**message, "content": " ".join(message["content"].split()) if message.get("content") else message.get("content")}
+                    for message in kwargs.get("messages", [])]
+        return digest(
+            str(kwargs.get("model")),
+            str(kwargs.get("temperature", 1)),
+            json.dumps(messages, sort_keys=True),
+            json.dumps(kwargs.get("functions", []), sort_keys=True),
+            *([str(kwargs["seed"])] if kwargs.get("seed") is not None else []))
+
+    async def completion(self, until: Optional[Callable[[dict], bool]] = None, **kwargs):
+        """Returns the chat completion for the given request, reusing cached completions for identical requests.
+        When sampled completions are cached too, the nth time a request is made reuses the nth completion cached
+        for it, so that repeating a request, e.g. a reevaluate after the same error, still gets a new sample.
+        If until is given, the completion is streamed: until is called with the message received so far
+        as it grows, and the rest of the completion is skipped once it returns True"""
+        if self.seed is not None:
+            kwargs.setdefault("seed", self.seed)
+
+        cached = None
+        key = None
+        if self.cache is not None and not (self.deterministic_cache and kwargs.get("temperature", 1) != 0):
+            key = self.cache_key(**kwargs)
+            if kwargs.get("temperature", 1) != 0:
+                if self.repeats is None:
+                    self.repeats = dict[str, int]()
+                repeat = self.repeats.get(key, 0)
+                self.repeats[key] = repeat + 1
+                if repeat > 0:
+                    key = digest(key, str(repeat))
+            cached = self.cache.get(key)
+            if cached is not None:
+                logging.debug(f"Reused cached completion, hit rate is {self.cache.hit_rate():.2f}")
+                result = json.loads(cached)
+                self.count(result, cached=True)
+                if until is not None:
+                    until(result["choices"][0]["message"])
+                return result
+        if self.replay:
+            raise LookupError("Only cached completions can be replayed, but this request isn't cached")
+
+        if until is None:
+            result = await self.completion_with_backoff(**kwargs)
+        else:
+            result = await self.stream_with_backoff(until, **kwargs)
+        self.report(result)
+        self.count(result)
+        if self.cache is not None and key is not None:
+            self.cache.put(key, json.dumps(result).encode())
+        return result
+
+    def estimate_tokens(self, **kwargs) -> int:
+        """Roughly estimates the tokens used by a request, at about 4 characters per token"""
+        return len(json.dumps(kwargs.get("messages", [])) + json.dumps(kwargs.get("functions", []))) // 4 + self.COMPLETION_TOKENS
+
     @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
     async def completion_with_backoff(self, **kwargs):
-        return await openai.ChatCompletion.acreate(**kwargs)
+        if self.scheduler is None:
+            return await openai.ChatCompletion.acreate(**kwargs)
+
+        estimated = self.estimate_tokens(**kwargs)
+        await self.scheduler.acquire(estimated)
+        try:
+            result = await openai.ChatCompletion.acreate(**kwargs)
+        except openai.error.RateLimitError:
+            # Pause every agent, instead of letting each of them retry on its own
+            self.scheduler.throttle(self.RATE_LIMIT_PAUSE)
+            self.scheduler.settle(estimated, 0)
+            raise
+        self.scheduler.settle(estimated, result["usage"]["total_tokens"]) # type: ignore
+        return result
 
-    async def plan(self, context: list[str], inventory: set[str], goal: str) -> list[str]:
-        """Given the context, inventory and goal, returns a list of tasks to achieve the goal"""
+    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+    async def stream_with_backoff(self, until: Callable[[dict], bool], **kwargs):
+        """completion_with_backoff, but streamed as described in completion"""
+        estimated = self.estimate_tokens(**kwargs)
+        if self.scheduler is not None:
+            await self.scheduler.acquire(estimated)
+
+        message = {"role": "assistant", "content": None}
+        try:
+            response = await openai.ChatCompletion.acreate(stream=True, **kwargs)
+            async for chunk in response: # type: ignore
+                delta = chunk["choices"][0]["delta"]
+                if delta.get("content"):
+                    message["content"] = (message["content"] or "") + delta["content"]
+                if delta.get("function_call"):
+                    function_call = message.setdefault("function_call", {"name": "", "arguments": ""})
+                    function_call["name"] += delta["function_call"].get("name", "")
+                    function_call["arguments"] += delta["function_call"].get("arguments", "")
+                if until(message):
+                    break
+            if hasattr(response, "aclose"):
+                await response.aclose() # type: ignore
+        except openai.error.RateLimitError:
+            if self.scheduler is not None:
+                self.scheduler.throttle(self.RATE_LIMIT_PAUSE)
+                self.scheduler.settle(estimated, 0)
+            raise
+
+        # Streamed completions don't report their usage, so it is estimated
+        prompt_tokens = estimated - self.COMPLETION_TOKENS
+        completion_tokens = self.estimate_tokens(messages=[message]) - self.COMPLETION_TOKENS
+        if self.scheduler is not None:
+            self.scheduler.settle(estimated, prompt_tokens + completion_tokens)
+        return {
+            "choices": [{"message": message}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def report(self, result):
+        """Logs the tokens used by a completion"""
+        usage = result.get("usage", {})
+        logging.info(f"Completion used {usage.get('prompt_tokens')} prompt and {usage.get('completion_tokens')} completion tokens")
+
+    def count(self, result, cached: bool = False):
+        """Adds a completion to the usage counters"""
+        usage = result.get("usage", {})
+        self.calls += 1
+        self.cached_calls += int(cached)
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+
+    async def plan(self, context: list[str], inventory: set[str], goal: str, first_task: Optional[Callable[[str], None]] = None) -> list[str]:
+        """Given the context, inventory and goal, returns a list of tasks to achieve the goal.
+        first_task may be called with the first task of the plan before the rest of it is known"""
         raise NotImplementedError()
 
     async def execute(self, context: list[str], inventory: set[str], plan: list[str]) -> tuple[object, Action]:
         """Given the context, inventory and task, returns the JSON string of the function to execute"""
         raise NotImplementedError()
 
-    async def reevaluate(self, context: list[str], memory: object, plan: list[str], goal: str, error: str = "") -> list[str]:
-        """Given the memory and error message, returns a list of new tasks"""
+    async def reevaluate(self, context: list[str], memory: object, plan: list[str], goal: str, error: str = "", first_task: Optional[Callable[[str], None]] = None) -> list[str]:
+        """Given the memory and error message, returns a list of new tasks. first_task is called as in plan"""
         raise NotImplementedError()
 
+    def executed(self, plan: list[str], action: Action) -> object:
+        """Returns the memory of an action chosen for the first task of the plan without calling execute"""
+        return None
+
+    async def plan_many(self, requests: list[tuple[list[str], set[str], str]]) -> list[list[str]]:
+        """plan for several characters at once, given the context, inventory and goal of each"""
+        return list(await asyncio.gather(*(self.plan(context, inventory, goal) for context, inventory, goal in requests)))
+
+    async def reevaluate_many(self, requests: list[tuple[list[str], object, list[str], str, str]]) -> list[list[str]]:
+        """reevaluate for several characters at once, given the context, memory, plan, goal and error of each"""
+        return list(await asyncio.gather(*(self.reevaluate(*request) for request in requests)))
+
 class HumanPrompt(Prompt):
     """Implementation of the prompt which asks the user for input"""
 
@@ -62,6 +227,129 @@ class HumanPrompt(Prompt):
             else:
                 print("Invalid action")
 
+class StubPrompt(Prompt):
+    """Implementation of the prompt which plans without a model, by chaining the interaction rules found in the context.
+    It only knows the rules of the built-in interactions, but it's deterministic and works offline"""
+
+    OBJECT = re.compile(r"There is an? '(?P<type>[^']+)' named '(?P<id>[^']+)'\.")
+    SHOP = re.compile(r"By interacting with an? '(?P<item>[^']+)' and an? '(?P<type>[^']+)', you can get an? '(?P<result>[^']+)'\.?")
+    BLOCKED = re.compile(r"Cannot reach '(?P<target>[^']+)' because '(?P<obstacle>[^']+)' is blocking the path")
+    # Verbs of the rules whose interactions remove their target from the world
+    REMOVING = ("open", "pick up")
+
+    def __init__(self, attempts: int = 3):
+        """Once the same task failed with the same error attempts times, the stub gives up"""
+        self.attempts = attempts
+        self.failures = dict[tuple[str, str], int]()
+        # Queries only return part of the context, so everything seen so far is kept
+        self.facts = dict[str, None]()
+        # Inventory and removed objects expected before the remaining tasks of the plans handed out,
+        # as reevaluate isn't given them
+        self.states = dict[tuple[str, ...], tuple[set[str], set[str]]]()
+
+    def search(self, goal: str, inventory: set[str], removed: set[str], obstacle: Optional[str] = None) -> list[str]:
+        """Returns the tasks which clear the given obstacle, if any, and then achieve the goal,
+        or an empty list if the facts seen so far aren't enough"""
+        rules = [match for match in map(RULE.fullmatch, self.facts) if match is not None]
+        shops = [match for match in map(self.SHOP.fullmatch, self.facts) if match is not None]
+        objects = {match["id"]: match["type"] for match in map(self.OBJECT.fullmatch, self.facts) if match is not None and match["id"] not in removed}
+        inventory = set(inventory)
+        plan = []
+        states = []
+
+        def use(target: str, item: str, verb: str = ""):
+            plan.extend([f"Walk to '{target}'", f"Interact with '{target}' using '{item}'"])
+            states.extend([(set(inventory), set(objects))] * 2)
+            if verb.lower() in self.REMOVING:
+                del objects[target]
+
+        def obtain(item: str, seeking: frozenset[str]) -> bool:
+            if item in inventory:
+                return True
+            if item in seeking:
+                return False
+            seeking = seeking | {item}
+            planned, held, present = len(plan), set(inventory), dict(objects)
+            for rule in rules:
+                if rule["verb"].lower() == "pick up" and objects.get(item) == rule["type"] and obtain(rule["item"], seeking):
+                    use(item, rule["item"], rule["verb"])
+                    inventory.add(item)
+                    return True
+            for shop in shops:
+                where = next((id for id, type in objects.items() if type == shop["type"]), None)
+                if shop["result"] == item and where is not None and obtain(shop["item"], seeking):
+                    use(where, shop["item"])
+                    inventory.discard(shop["item"])
+                    inventory.add(item)
+                    return True
+            # Forget whatever the failed attempts planned
+            del plan[planned:]
+            del states[planned:]
+            inventory.clear()
+            inventory.update(held)
+            objects.clear()
+            objects.update(present)
+            return False
+
+        def perform(accepts: Callable[[re.Match, str], bool]) -> bool:
+            for rule in rules:
+                target = next((id for id, type in objects.items() if type == rule["type"] and accepts(rule, id)), None)
+                if target is not None and obtain(rule["item"], frozenset()):
+                    use(target, rule["item"], rule["verb"])
+                    return True
+            return False
+
+        if obstacle is not None:
+            # The blocking object is just the first one on the cheapest path through objects, which may not be removeable,
+            # in which case anything which can be opened is tried
+            if not perform(lambda _, id: id == obstacle) and not perform(lambda rule, _: rule["verb"].lower() == "open"):
+                return []
+        verb = goal.strip().rstrip(".!").lower()
+        if not perform(lambda rule, _: rule["verb"].lower().startswith(verb)):
+            return []
+
+        known = {match["id"] for match in map(self.OBJECT.fullmatch, self.facts) if match is not None}
+        states.append((inventory, set(objects)))
+        for i, (held, present) in enumerate(states):
+            self.states[tuple(plan[i:])] = (held, known - present)
+        return plan
+
+    def answer(self, context: list[str], inventory: set[str], removed: set[str], goal: str, obstacle: Optional[str] = None) -> list[str]:
+        self.facts.update(dict.fromkeys(context))
+        plan = self.search(goal, inventory, removed, obstacle)
+        if not plan:
+            raise ValueError(f"Found no plan for '{goal}' in the context seen so far")
+        return plan
+
+    async def plan(self, context: list[str], inventory: set[str], goal: str, first_task: Optional[Callable[[str], None]] = None) -> list[str]:
+        return self.answer(context, inventory, set(), goal)
+
+    async def execute(self, context: list[str], inventory: set[str], plan: list[str]) -> tuple[object, Action]:
+        task = plan[0].strip().rstrip(".!")
+        match = WALK.fullmatch(task)
+        if match:
+            return None, Walk(StepInterpreter.name(match["target"]))
+        match = INTERACT.fullmatch(task)
+        if match:
+            return None, Interact(StepInterpreter.name(match["item"]), StepInterpreter.name(match["target"]))
+        raise ValueError(f"Cannot execute '{plan[0]}'")
+
+    async def reevaluate(self, context: list[str], memory: object, plan: list[str], goal: str, error: str = "", first_task: Optional[Callable[[str], None]] = None) -> list[str]:
+        if error and plan:
+            # Virtual time stands still while the character waits, so a task which keeps failing must not be retried forever
+            failures = self.failures[(plan[0], error)] = self.failures.get((plan[0], error), 0) + 1
+            if failures >= self.attempts:
+                raise ValueError(f"'{plan[0]}' failed {failures} times with error '{error}'")
+        inventory, removed = self.states.get(tuple(plan), (set(), set()))
+        blocked = self.BLOCKED.search(error)
+        return self.answer(context, inventory, removed, goal, blocked["obstacle"] if blocked else None)
+
+class ApproximateEncoding():
+    """Stand-in for a tiktoken encoding, at about 4 characters per token"""
+
+    def encode(self, text: str) -> list[int]:
+        return [0] * ((len(text) + 3) // 4)
+
 class OpenAIPrompt(Prompt):
     """Implementation of the prompt which uses the OpenAI API"""
 
@@ -100,9 +388,65 @@ class OpenAIPrompt(Prompt):
         }
     ]
 
-    def __init__(self, api_key: str, model: str):
+    def __init__(self, api_key: str, model: str, scheduler: Optional[Scheduler] = None, cache: Optional[Cache] = None, deterministic_cache: bool = True,
+                 context_tokens: int = 2000, stream: bool = True, replay: bool = False, seed: Optional[int] = None):
+        """If a scheduler is given, requests wait for it to admit them.
+        If a cache is given, identical requests reuse its completions, only at temperature 0 if deterministic_cache is set.
+        If replay is set, requests which aren't cached fail instead of reaching the API.
+        A seed makes sampling reproducible, as far as the API allows, and gives each seed its own cached completions.
+        The context pasted into each prompt is cut down to at most context_tokens tokens.
+        If stream is set, completions are streamed so that their results can be acted upon before they finish"""
         openai.api_key = api_key
         self.model = model
+        self.scheduler = scheduler
+        self.cache = cache
+        self.deterministic_cache = deterministic_cache
+        self.context_tokens = context_tokens
+        self.stream = stream
+        self.replay = replay
+        self.seed = seed
+        self.tokenizer = None
+
+    def count_tokens(self, text: str) -> int:
+        """Counts the tokens of the given text, or estimates them if the model's encoding can't be loaded,
+        as tiktoken downloads encodings on first use"""
+        if self.tokenizer is None:
+            try:
+                try:
+                    self.tokenizer = tiktoken.encoding_for_model(self.model)
+                except KeyError:
+                    self.tokenizer = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logging.warning(f"Could not load the encoding of '{self.model}', token counts are estimated: {e}")
+                self.tokenizer = ApproximateEncoding()
+        return len(self.tokenizer.encode(text))
+
+    def estimate_tokens(self, **kwargs) -> int:
+        """Counts the tokens of a request, plus the ones reserved for its completion"""
+        tokens = self.COMPLETION_TOKENS
+        for message in kwargs.get("messages", []):
+            # Every message has a few tokens of overhead for its role and delimiters
+            tokens += 4 + self.count_tokens(message.get("content") or "")
+            if "function_call" in message:
+                tokens += self.count_tokens(json.dumps(message["function_call"]))
+        if "functions" in kwargs:
+            tokens += self.count_tokens(json.dumps(kwargs["functions"]))
+        return tokens
+
+    def fit(self, context: list[str]) -> list[str]:
+        """Keeps the most relevant lines of the context which fit in the token budget.
+        The context is ranked from most to least relevant, and the lines left out are replaced by a note saying how many there were"""
+        fitted = []
+        tokens = 0
+        for line in context:
+            tokens += self.count_tokens(line) + 1
+            if tokens > self.context_tokens:
+                break
+            fitted.append(line)
+        if len(fitted) < len(context):
+            logging.info(f"Left {len(context) - len(fitted)} of {len(context)} context lines out of the prompt")
+            fitted.append(f"({len(context) - len(fitted)} less important facts were left out.)")
+        return fitted
 
     def sanitize(self, string: str) -> str:
         out = ""
@@ -127,9 +471,43 @@ class OpenAIPrompt(Prompt):
     def print_plan(self, plan: list[str]) -> str:
         return "\n".join([f"{i + 1}. {task}" for i, task in enumerate(plan)])
     
-    async def prompt_plan(self, messages: list) -> list[str]:
+    def function_call_parser(self) -> Optional[Callable[[dict], bool]]:
+        """Returns a function which stops a streamed completion as soon as it holds a complete walk or interact call"""
+        if not self.stream:
+            return None
+
+        def until(message: dict) -> bool:
+            function_call = message.get("function_call")
+            if function_call is None or function_call["name"] not in ["walk", "interact"] or not function_call["arguments"].rstrip().endswith("}"):
+                return False
+            try:
+                json.loads(function_call["arguments"])
+                return True
+            except json.JSONDecodeError:
+                return False
+        return until
+
+    def first_task_parser(self, first_task: Optional[Callable[[str], None]]) -> Optional[Callable[[dict], bool]]:
+        """Returns a function which watches a streamed plan, calling first_task once its first line is complete"""
+        if first_task is None or not self.stream:
+            return None
+
+        called = False
+        def until(message: dict) -> bool:
+            nonlocal called
+            content = message["content"] or ""
+            if not called and "\n" in content.lstrip():
+                called = True
+                plan = self.parse_plan(content.lstrip().split("\n", 1)[0])
+                if isinstance(plan, list) and plan:
+                    first_task(plan[0])
+            return False
+        return until
+
+    async def prompt_plan(self, messages: list, first_task: Optional[Callable[[str], None]] = None) -> list[str]:
         while True:
-            result = await self.completion_with_backoff(
+            result = await self.completion(
+                    self.first_task_parser(first_task),
                     model=self.model,
                     temperature=0.5,
                     messages=messages,
@@ -145,7 +523,7 @@ class OpenAIPrompt(Prompt):
                     return plan
                 messages += [{"role": "system", "content": plan}]
 
-    async def plan(self, context: list[str], inventory: set[str], goal: str) -> list[str]:
+    async def plan(self, context: list[str], inventory: set[str], goal: str, first_task: Optional[Callable[[str], None]] = None) -> list[str]:
         newline = "\n"
         prompt = self.sanitize(f'''
             You are a character in a world.
@@ -165,11 +543,11 @@ class OpenAIPrompt(Prompt):
 
             Information about the world (ranked from most to least important):
             """
-            {newline.join(context)}
+            {newline.join(self.fit(context))}
             """
         ''')
 
-        plan = await self.prompt_plan([{"role": "system", "content": prompt}])
+        plan = await self.prompt_plan([{"role": "system", "content": prompt}], first_task)
 
         print()
         print(f"-------- OpenAI plan response --------")
@@ -178,6 +556,68 @@ class OpenAIPrompt(Prompt):
 
         return plan
 
+    async def plan_many(self, requests: list[tuple[list[str], set[str], str]]) -> list[list[str]]:
+        """Plans for every character with a single completion, sharing the context between them.
+        Characters whose plan can't be read from the response are planned for on their own"""
+        if len(requests) == 1:
+            return [await self.plan(*requests[0])]
+
+        # Interleave the contexts by rank, so that the shared context keeps what's most important to every character
+        context = list(dict.fromkeys(line for lines in itertools.zip_longest(*(context for context, _, _ in requests)) for line in lines if line is not None))
+        newline = "\n"
+        characters = newline.join(
+            f"Character {i + 1} has the final goal '{goal}' and an inventory which contains the following items: {', '.join(inventory)}."
+            for i, (_, inventory, goal) in enumerate(requests))
+        prompt = self.sanitize(f'''
+            You are planning for {len(requests)} characters in a world.
+            Taking into account the information below about the world, decompose the final goal of each character into a plan of one or more specific achievable tasks.
+            For each character, write a line with "Character N:" followed by a numbered list where each line corresponds to a single task.
+            Each task should a single, concise sentence, and be achievable using the functions walk and interact.
+
+            {characters}
+
+            A valid input for two characters would be:
+            """
+            Character 1:
+            1. Walk to Y
+            2. Pick up Y
+            Character 2:
+            1. Walk to X
+            2. Interact with X using Y
+            """
+
+            Information about the world (ranked from most to least important):
+            """
+            {newline.join(self.fit(context))}
+            """
+        ''')
+
+        return await self.prompt_many(prompt, [lambda request=request: self.plan(*request) for request in requests], "plan")
+
+    async def prompt_many(self, prompt: str, alone: list[Callable[[], Awaitable[list[str]]]], what: str) -> list[list[str]]:
+        """Completes a prompt which asks for a "Character N:" section with a plan for each character.
+        Characters whose plan can't be read from the response are prompted for on their own, with their function in alone"""
+        result = await self.completion(model=self.model, temperature=0.5, messages=[{"role": "system", "content": prompt}])
+        content = result["choices"][0]["message"]["content"] or "" # type: ignore
+        sections = dict[int, str]()
+        for match in re.finditer(r"^\s*Character (\d+):\s*$(.*?)(?=^\s*Character \d+:|\Z)", content, re.MULTILINE | re.DOTALL):
+            sections[int(match[1]) - 1] = match[2]
+
+        plans = [self.parse_plan(sections.get(i, "")) for i in range(len(alone))]
+        missing = [i for i, plan in enumerate(plans) if not isinstance(plan, list) or not plan]
+        if missing:
+            logging.info(f"Prompting again for {len(missing)} of {len(alone)} characters missing from the batched {what}")
+            for i, plan in zip(missing, await asyncio.gather(*(alone[i]() for i in missing))):
+                plans[i] = plan
+
+        print()
+        print(f"-------- OpenAI batched {what} response --------")
+        for i, plan in enumerate(plans):
+            print(f"Character {i + 1}: {plan}")
+        print()
+
+        return plans # type: ignore
+
     async def execute(self, context: list[str], inventory: set[str], plan: list[str]) -> tuple[object, Action]:
         newline = "\n"
         prompt = self.sanitize(f'''
@@ -190,14 +630,15 @@ class OpenAIPrompt(Prompt):
             Information about the world (ranked from most to least important):
             """
             You have an inventory, which contains the following items: {", ".join(inventory)}.
-            {newline.join(context)}
+            {newline.join(self.fit(context))}
             """
         ''')
 
         memory = [{"role": "system", "content": prompt}]
 
         while True:
-            result = await self.completion_with_backoff(
+            result = await self.completion(
+                    self.function_call_parser(),
                     model=self.model,
                     temperature=0.5,
                     messages=memory,
@@ -226,7 +667,15 @@ class OpenAIPrompt(Prompt):
         else:
             assert False, "bah!"
 
-    async def reevaluate(self, context: list[str], memory: list, plan: list[str], goal: str, error: str = "") -> list[str]:
+    def executed(self, plan: list[str], action: Action) -> object:
+        if isinstance(action, Walk):
+            function_call = {"name": "walk", "arguments": json.dumps({"target": action.target})}
+        else:
+            assert isinstance(action, Interact)
+            function_call = {"name": "interact", "arguments": json.dumps({"item": action.item_id, "target": action.target_id})}
+        return [{"role": "assistant", "content": None, "function_call": function_call}]
+
+    async def reevaluate(self, context: list[str], memory: list, plan: list[str], goal: str, error: str = "", first_task: Optional[Callable[[str], None]] = None) -> list[str]:
         newline = "\n"
         if error:
             what = "error"
@@ -270,11 +719,11 @@ class OpenAIPrompt(Prompt):
 
             Information about the world (ranked from most to least important):
             """
-            {newline.join(context)}
+            {newline.join(self.fit(context))}
             """
         '''
 
-        plan = await self.prompt_plan(memory + [{"role": "system", "content": prompt}])
+        plan = await self.prompt_plan(memory + [{"role": "system", "content": prompt}], first_task)
 
         print()
         print(f"-------- OpenAI {what} response --------")
@@ -282,3 +731,50 @@ class OpenAIPrompt(Prompt):
         print()
 
         return plan
+
+    async def reevaluate_many(self, requests: list[tuple[list[str], list, list[str], str, str]]) -> list[list[str]]:
+        """Reevaluates the plans of every character with a single completion, sharing the context between them.
+        Instead of its whole memory, each character's section has the function it called last and how it went"""
+        if len(requests) == 1:
+            return [await self.reevaluate(*requests[0])]
+
+        newline = "\n"
+        sections = []
+        for i, (_, memory, plan, goal, error) in enumerate(requests):
+            calls = [message["function_call"] for message in memory if message.get("function_call")]
+            call = f"called the function {calls[-1]['name']} with the arguments {calls[-1]['arguments']}" if calls else "did nothing yet"
+            if error:
+                outcome = f"It {call}, which failed with the error: {error}"
+            elif not plan:
+                outcome = f"It {call}, which completed its plan, but it still hasn't achieved its final goal."
+            else:
+                outcome = f"It {call}, which succeeded, completing the task '{plan[0]}'. Remove only that task, unless the plan needs to change."
+            current = f"Its current plan is:{newline}{self.print_plan(plan)}" if plan else "It has no plan left."
+            sections.append(f"Character {i + 1} has the final goal '{goal}'. {outcome}{newline}{current}")
+
+        context = list(dict.fromkeys(line for lines in itertools.zip_longest(*(context for context, _, _, _, _ in requests)) for line in lines if line is not None))
+        prompt = self.sanitize(f'''
+            You are planning for {len(requests)} characters in a world.
+            Taking into account the information below about the world, and what happened to each character, reevaluate the plan of each character.
+            For each character, write a line with "Character N:" followed by a numbered list where each line corresponds to a single task.
+            Each task should a single, concise sentence, and be achievable using the functions walk and interact.
+
+            {(newline + newline).join(sections)}
+
+            A valid input for two characters would be:
+            """
+            Character 1:
+            1. Walk to Y
+            2. Pick up Y
+            Character 2:
+            1. Walk to X
+            2. Interact with X using Y
+            """
+
+            Information about the world (ranked from most to least important):
+            """
+            {newline.join(self.fit(context))}
+            """
+        ''')
+
+        return await self.prompt_many(prompt, [lambda request=request: self.reevaluate(*request) for request in requests], "reevaluate")
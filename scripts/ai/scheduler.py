@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+
+from collections import defaultdict
+from typing import Optional
+
+# Id of the agent on whose behalf requests are being made, and since when it has been waiting for a decision
+agent = contextvars.ContextVar[tuple[str, float]]("agent", default=("", 0.0))
+
+class TokenBucket:
+    """Rate limiter which refills at a constant rate per minute, up to a capacity"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """By default, bursts of up to 10 seconds worth of the rate are allowed"""
+        self.rate = per_minute / 60
+        self.capacity = capacity if capacity is not None else per_minute / 6
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Returns how many seconds until the given amount is available. Amounts over the capacity wait for a full bucket"""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, seconds: float, now: float):
+        """Empties the bucket so that nothing is available for the given number of seconds"""
+        self.refill(now)
+        self.level = min(self.level, -seconds * self.rate)
+
+class Scheduler:
+    """Admits requests to a rate limited API, within a budget of requests and tokens per minute.
+    Waiting requests are admitted in order of how long their agent has been waiting for a decision,
+    and then of how few requests their agent has had admitted"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.served = defaultdict[str, int](int)
+        self.waiting = []
+        self.order = itertools.count()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, tokens: int):
+        """Waits until a request which uses up to the given number of tokens can be made"""
+        id, since = agent.get()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (since, self.served[id], next(self.order), id, tokens, future))
+        self.__dispatch()
+        await future
+
+    def settle(self, estimated: int, used: int):
+        """Corrects the tokens taken by a request, once its actual usage is known"""
+        if used < estimated:
+            self.tokens.give(estimated - used)
+        else:
+            self.tokens.take(used - estimated)
+
+    def throttle(self, seconds: float):
+        """Stops admitting requests for the given number of seconds, e.g. after being rate limited by the API"""
+        now = time.monotonic()
+        self.requests.drain(seconds, now)
+        self.tokens.drain(seconds, now)
+
+    def __dispatch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        now = time.monotonic()
+        while self.waiting:
+            _, _, _, id, tokens, future = self.waiting[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self.waiting)
+                continue
+
+            delay = max(self.requests.delay(1, now), self.tokens.delay(tokens, now))
+            if delay > 0:
+                self.timer = asyncio.get_running_loop().call_later(delay, self.__dispatch)
+                return
+
+            heapq.heappop(self.waiting)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.served[id] += 1
+            future.set_result(None)
@@ -2,36 +2,47 @@ import pygame
 import logging
 import asyncio
 
-from typing import Optional
+from typing import Callable, Optional
 
-from world import World, Controller, Interaction
-from renderer import Renderer
+from world import World, Controller, Interaction, Idle
+from renderer import Renderer, TILES_PATH
+from renderer.tiles import TileLocator
 from console import Console
 
 SCALE = 2
 
 class App:
-    def __init__(self, size: tuple[int, int]):
+    def __init__(self, size: tuple[int, int], headless: bool = False):
+        """Headless apps have no display nor renderer, and are only stepped with simulate"""
         self.size = size
+        self.headless = headless
 
-        pygame.init()
         logging.basicConfig(level=logging.INFO)
 
         self.console = Console()
         self.world = World(size)
-        self.screen = pygame.display.set_mode((self.world.size[0] * 16 * SCALE, self.world.size[1] * 16 * SCALE))
-        self.orig_screen = pygame.Surface((self.world.size[0] * 16, self.world.size[1] * 16))
-        self.renderer = Renderer(self.world, self.console)
+        self.renderer: Optional[Renderer] = None
+        if self.headless:
+            self.areas = TileLocator.load_areas(TILES_PATH)
+        else:
+            pygame.init()
+            self.screen = pygame.display.set_mode((self.world.size[0] * 16 * SCALE, self.world.size[1] * 16 * SCALE))
+            self.orig_screen = pygame.Surface((self.world.size[0] * 16, self.world.size[1] * 16))
+            self.renderer = Renderer(self.world, self.console)
+            self.areas = self.renderer.tile_locator.areas
         self.running = True
+        # Ticks simulated so far by simulate
+        self.ticks = 0
 
     def __del__(self):
-        pygame.quit()
+        if not self.headless:
+            pygame.quit()
 
     def add_interaction(self, type: str, interaction: Interaction):
         self.world.add_interaction(type, interaction)
 
     def add_object_type(self, name: str, interaction: Optional[Interaction] = None, occlude=True):
-        _, _, w, h = self.renderer.tile_locator[name]
+        _, _, w, h = self.areas[name]
         self.world.add_object_type(name, (w, h), interaction, occlude)
     
     def add_object(self, type_id: str, name: str, position: tuple[int, int]):
@@ -43,15 +54,17 @@ class App:
         self.world.add_character(name, controller, position, inventory)
 
     def place_ground(self, area: str, position: tuple[int, int], impassable: bool = True):
-        self.renderer.layers.ground.place(position, self.renderer.tile_locator[area])
+        if self.renderer is not None:
+            self.renderer.layers.ground.place(position, self.areas[area])
         if impassable:
-            _, _, w, h = self.renderer.tile_locator[area]
+            _, _, w, h = self.areas[area]
             self.world.make_impassable(position + (w, h))
 
     def place_decor(self, area: str, position: tuple[int, int], impassable: bool = True):
-        self.renderer.layers.objects.place(position, self.renderer.tile_locator[area])
+        if self.renderer is not None:
+            self.renderer.layers.objects.place(position, self.areas[area])
         if impassable:
-            _, _, w, h = self.renderer.tile_locator[area]
+            _, _, w, h = self.areas[area]
             self.world.make_impassable(position + (w, h))
 
     def poll_events(self):
@@ -68,7 +81,8 @@ class App:
 
     def tick(self, delta_t: float):
         self.world.tick(delta_t)
-        self.renderer.tick(delta_t)
+        if self.renderer is not None:
+            self.renderer.tick(delta_t)
     
     def render(self):
         self.orig_screen.fill((0, 0, 0))
@@ -78,18 +92,47 @@ class App:
 
     async def async_run(self):
         last_t = pygame.time.get_ticks()
-        while True:
-            self.poll_events()
-            if not self.running:
-                break
-
-            now_t = pygame.time.get_ticks()
-            delta_t = (now_t - last_t) / 1000
-            last_t = now_t
-
-            self.tick(delta_t)
-            self.render()
-            await asyncio.sleep(0.01)
+        try:
+            while True:
+                self.poll_events()
+                if not self.running:
+                    break
+
+                now_t = pygame.time.get_ticks()
+                delta_t = (now_t - last_t) / 1000
+                last_t = now_t
+
+                self.tick(delta_t)
+                self.render()
+                await asyncio.sleep(0.01)
+        finally:
+            self.world.close()
 
     def run(self):
         asyncio.run(self.async_run())
+
+    async def simulate(self, delta_t: float, done: Callable[[], bool], max_ticks: Optional[int] = None) -> int:
+        """Ticks the world with a fixed virtual delta_t, as fast as possible, until done returns True
+        or max_ticks have passed. Never renders, only yielding to let the controllers' tasks progress.
+        While every character is waiting for its controller to decide, virtual time stands still,
+        so that the result doesn't depend on how fast the database and prompt answer.
+        Returns the number of ticks simulated"""
+        ticks = 0
+        waited = 0
+        self.ticks = 0
+        try:
+            while not done() and (max_ticks is None or ticks < max_ticks):
+                if all(isinstance(character.action, Idle) and character.action.finish for character in self.world.characters.values()):
+                    self.world.tick(0)
+                    # Stop spinning when the wait is long, e.g. on a request to a remote API
+                    waited += 1
+                    await asyncio.sleep(0 if waited < 100 else 0.001)
+                    continue
+                self.world.tick(delta_t)
+                ticks += 1
+                self.ticks = ticks
+                waited = 0
+                await asyncio.sleep(0)
+        finally:
+            self.world.close()
+        return ticks
@@ -0,0 +1,52 @@
+import argparse
+import numpy as np
+import time
+
+from ai.index import IVFIndex
+
+def dataset(rng: np.random.Generator, count: int, dim: int, clusters: int, spread: float) -> np.ndarray:
+    """Returns normalized vectors scattered around random centers, which resemble the structure of text embeddings.
+    With many clusters and a spread above 1, neighbourhoods cross the boundaries of the index's lists,
+    so that recall depends on how many lists are probed"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + spread * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def exact(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors @ query
+    best = np.argpartition(scores, -k)[-k:]
+    return best[np.argsort(-scores[best])]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the recall and latency of IVFIndex against exact search")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--spread", type=float, default=1.25, help="Standard deviation of the vectors around their cluster's center")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = dataset(rng, args.count + args.queries, args.dim, args.clusters, args.spread)
+    vectors, queries = vectors[:args.count], vectors[args.count:]
+
+    start = time.perf_counter()
+    index = IVFIndex(args.nlist)
+    index.add(list(range(args.count)), vectors)
+    print(f"Built index over {args.count} vectors in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    truth = [set(exact(vectors, query, args.k).tolist()) for query in queries]
+    latency = (time.perf_counter() - start) / args.queries
+    print(f"exact:      recall@{args.k} 1.000, {latency * 1000:.3f}ms per query")
+
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        start = time.perf_counter()
+        found = [index.search(query, args.k) for query in queries]
+        latency = (time.perf_counter() - start) / args.queries
+        recall = np.mean([len(expected.intersection(result)) / args.k for expected, result in zip(truth, found)])
+        print(f"nprobe {nprobe:3}: recall@{args.k} {recall:.3f}, {latency * 1000:.3f}ms per query")
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import contextlib
+import dotenv
+import io
+import json
+import logging
+import numpy as np
+import os
+import random
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import levels
+
+from ai.cache import Cache
+from ai.database import LocalDatabase, DumbDatabase, openai_embed, stub_embed
+from ai.prompt import OpenAIPrompt, StubPrompt
+from ai.scheduler import Scheduler
+
+def episode(level: str, seed: int, args: argparse.Namespace) -> dict:
+    """Plays one episode of the given level headlessly, and returns its metrics"""
+    random.seed(seed)
+    np.random.seed(seed)
+    # Keep the workers quiet, App only configures logging if it hasn't been already
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.database == "local":
+        embed = stub_embed if args.embeddings == "stub" else openai_embed
+        db = LocalDatabase(args.encoding, args.embedding_model, Cache("embeddings", args.embedding_cache), embed)
+    else:
+        db = DumbDatabase()
+
+    # Every worker gets its share of the rate limits
+    scheduler = None
+    if args.prompt == "openai":
+        scheduler = Scheduler(args.requests_per_minute / args.workers, args.tokens_per_minute / args.workers)
+    if args.prompt == "stub":
+        prompt = StubPrompt()
+    else:
+        prompt = OpenAIPrompt(
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            model=args.model,
+            scheduler=scheduler,
+            # Sampled completions are cached too, so that episodes can be replayed
+            cache=Cache("completions", args.completion_cache),
+            deterministic_cache=False,
+            replay=args.prompt == "replay",
+            seed=seed)
+
+    result = {"level": level, "seed": seed, "won": False, "ticks": 0, "error": ""}
+    start = time.perf_counter()
+    app = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = levels.app(level, db, prompt, headless=True)
+            # Virtual time stands still while the characters wait for their controllers, so a controller which
+            # never settles on an action is only stopped by the timeout
+            asyncio.run(asyncio.wait_for(app.simulate(args.delta_t, lambda: levels.won(app), args.max_ticks), args.timeout))
+            result["won"] = levels.won(app)
+    except asyncio.TimeoutError:
+        result["error"] = f"TimeoutError: the episode took longer than {args.timeout}s"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    if app is not None:
+        result["ticks"] = app.ticks
+
+    result["game_time"] = result["ticks"] * args.delta_t
+    result["wall_time"] = time.perf_counter() - start
+    result["llm_calls"] = prompt.calls
+    result["cached_llm_calls"] = prompt.cached_calls
+    result["prompt_tokens"] = prompt.prompt_tokens
+    result["completion_tokens"] = prompt.completion_tokens
+    result["failed_actions"] = sum(character.failures for character in app.world.characters.values()) if app is not None else 0
+    return result
+
+def summarize(results: list[dict]):
+    """Prints the metrics of each level, averaged over its episodes"""
+    for level in sorted({result["level"] for result in results}):
+        episodes = [result for result in results if result["level"] == level]
+        wins = [result for result in episodes if result["won"]]
+        errors = sum(1 for result in episodes if result["error"])
+        ticks = f"{np.mean([result['ticks'] for result in wins]):.0f}" if wins else "-"
+        calls = np.mean([result["llm_calls"] for result in episodes])
+        tokens = np.mean([result["prompt_tokens"] + result["completion_tokens"] for result in episodes])
+        failures = np.mean([result["failed_actions"] for result in episodes])
+        print(f"{level}: won {len(wins)}/{len(episodes)} ({errors} errors), {ticks} ticks to win, "
+              f"{calls:.1f} LLM calls, {tokens:.0f} tokens, {failures:.1f} failed actions per episode")
+
+if __name__ == "__main__":
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description="Plays levels many times in parallel, without a display, and records the metrics of every episode")
+    parser.add_argument("--levels", nargs="+", default=["pickup_and_open", "shops"])
+    parser.add_argument("--episodes", type=int, default=10, help="Episodes per level")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first episode of each level, the next ones count up from it")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="results.jsonl", help="File to which the metrics of each episode are written, one JSON object per line")
+    parser.add_argument("--delta-t", type=float, default=1 / 60)
+    parser.add_argument("--max-ticks", type=int, default=36000, help="Ticks after which an episode is given up")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds after which an episode is given up")
+    parser.add_argument("--database", choices=["local", "dumb"], default="local")
+    parser.add_argument("--embeddings", choices=["stub", "openai"], default="stub")
+    parser.add_argument("--encoding", default="cl100k_base")
+    parser.add_argument("--embedding-model", default="text-embedding-ada-002")
+    parser.add_argument("--embedding-cache", default="embeddings.db")
+    parser.add_argument("--prompt", choices=["stub", "replay", "openai"], default="stub",
+                        help="stub plans from the interaction rules without a model, replay only uses completions from the completion cache, "
+                             "openai makes the missing ones")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--completion-cache", default="completions.db")
+    parser.add_argument("--requests-per-minute", type=float, default=3500)
+    parser.add_argument("--tokens-per-minute", type=float, default=90000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(args.workers) as executor, open(args.output, "w") as output:
+        futures = [executor.submit(episode, level, args.seed + i, args) for level in args.levels for i in range(args.episodes)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    print(f"Played {len(results)} episodes with {args.workers} workers in {time.perf_counter() - start:.2f}s, results written to '{args.output}'")
+    summarize(results)
@@ -18,5 +18,5 @@ class Give(Interaction):
         if item_id in world.characters[target_id].inventory:
             return f"{target_id} already has '{item_id}'"
 
-        world.characters[target_id].inventory.add(item_id)
+        world.add_item(target_id, item_id)
         return ""
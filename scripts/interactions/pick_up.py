@@ -19,6 +19,6 @@ class PickUp(Interaction):
         if target_id in world.characters[chr_id].inventory:
             return f"Cannot pick up '{target_id}' because you already have it"
 
-        world.objects.pop(target_id)
-        world.characters[chr_id].inventory.add(target_id)
+        world.remove_object(target_id)
+        world.add_item(chr_id, target_id)
         return ""
@@ -20,6 +20,6 @@ class Shop(Interaction):
         if self.sell_item in world.characters[chr_id].inventory:
             return f"Cannot buy '{self.sell_item}' because you already have it"
         
-        world.characters[chr_id].inventory.remove(item_id)
-        world.characters[chr_id].inventory.add(self.sell_item)
+        world.remove_item(chr_id, item_id)
+        world.add_item(chr_id, self.sell_item)
         return ""
@@ -2,9 +2,14 @@ import asyncio
 
 from app import App
 from ai import Database, Prompt
+from interactions import Win
 
-def app(name: str, db: Database, prompt: Prompt) -> App:
-    """Returns the app for the given level"""
-    app = __import__(name, globals(), locals(), level=1).app(db, prompt)
+def app(name: str, db: Database, prompt: Prompt, headless: bool = False) -> App:
+    """Returns the app for the given level. Headless apps have no display, and must be run with App.simulate"""
+    app = __import__(name, globals(), locals(), level=1).app(db, prompt, headless)
     asyncio.run(db.fill(app.world))
     return app
+
+def won(app: App) -> bool:
+    """Returns whether any of the win conditions of the given app's level has been met"""
+    return any(isinstance(interaction, Win) and interaction.flag[0] for interaction in app.world.interactions.values())
@@ -2,8 +2,8 @@ from app import App
 from world import ScriptedController, HumanController, Walk, Ask
 from interactions import Open, PickUp, Give
 
-def app(db, prompt) -> App:
-    app = App((32, 20))
+def app(db, prompt, headless=False) -> App:
+    app = App((32, 20), headless)
 
     # Allow characters to give stuff to each other (but not their hands)
     app.add_interaction("character", Give({"hand"}))
@@ -2,8 +2,8 @@ from app import App
 from interactions import Win
 from ai import Database, Prompt, AIController
 
-def app(db: Database, prompt: Prompt) -> App:
-    app = App((32, 20))
+def app(db: Database, prompt: Prompt, headless: bool = False) -> App:
+    app = App((32, 20), headless)
     flag = [False]
 
     app.add_object_type("goal", Win("hand", "goal", flag))
@@ -1,9 +1,15 @@
+import asyncio
 import dotenv
 import levels
 import os
+import time
 
-from ai.database import SingleStoreDatabase, DumbDatabase
+from ai.cache import Cache
+from ai.index import IVFIndex
+from ai.database import SingleStoreDatabase, LocalDatabase, DumbDatabase, openai_embed, stub_embed
+from ai.batch import BatchedPrompt
 from ai.prompt import HumanPrompt, OpenAIPrompt
+from ai.scheduler import Scheduler
 
 if __name__ == "__main__":
     dotenv.load_dotenv()
@@ -11,29 +17,69 @@ if __name__ == "__main__":
     db = os.getenv("DATABASE", "s2")
     prompt = os.getenv("PROMPT_SOURCE", "openai")
 
-    if db == "s2":
+    if db in ("s2", "local"):
         encoding = os.getenv("ENCODING_NAME", "cl100k_base")
         model = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
-        host = os.getenv("S2_DB_HOST", "")
-        port = int(os.getenv("S2_DB_PORT", 0))
-        user = os.getenv("S2_DB_USER", "")
-        password = os.getenv("S2_DB_PASSWORD", "")
-        database = os.getenv("S2_DB_DATABASE", "")
-        db = SingleStoreDatabase(encoding, model, host, port, user ,password, database)
+        cache = Cache("embeddings", os.getenv("EMBEDDING_CACHE", "embeddings.db"))
+        embed = os.getenv("EMBEDDING_SOURCE", "openai")
+        if embed == "openai":
+            embed = openai_embed
+        elif embed == "stub":
+            embed = stub_embed
+        else:
+            raise ValueError(f"Invalid embedding source '{embed}': must be either 'openai' or 'stub'")
+
+        if db == "s2":
+            host = os.getenv("S2_DB_HOST", "")
+            port = int(os.getenv("S2_DB_PORT", 0))
+            user = os.getenv("S2_DB_USER", "")
+            password = os.getenv("S2_DB_PASSWORD", "")
+            database = os.getenv("S2_DB_DATABASE", "")
+            db = SingleStoreDatabase(encoding, model, host, port, user ,password, database, cache, embed)
+        else:
+            index = os.getenv("LOCAL_INDEX", "exact")
+            if index == "exact":
+                index = None
+            elif index == "ivf":
+                index = IVFIndex(int(os.getenv("IVF_NLIST", 256)), int(os.getenv("IVF_NPROBE", 8)))
+            else:
+                raise ValueError(f"Invalid local index '{index}': must be either 'exact' or 'ivf'")
+            db = LocalDatabase(encoding, model, cache, embed, index=index, index_path=os.getenv("IVF_INDEX_PATH") or None)
     elif db == "dumb":
         db = DumbDatabase()
     else:
-        raise ValueError(f"Invalid database '{db}': must be either 's2' or 'dumb'")
+        raise ValueError(f"Invalid database '{db}': must be either 's2', 'local' or 'dumb'")
 
     if prompt == "openai":
         key = os.getenv("OPENAI_API_KEY")
         assert key is not None, "OPENAI_API_KEY must be set to use the OpenAI prompt"
         prompt = OpenAIPrompt(
             api_key=key,
-            model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"))
+            model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+            scheduler=Scheduler(
+                requests_per_minute=float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 3500)),
+                tokens_per_minute=float(os.getenv("OPENAI_TOKENS_PER_MINUTE", 90000))),
+            cache=Cache("completions", os.getenv("COMPLETION_CACHE", "completions.db")),
+            deterministic_cache=os.getenv("COMPLETION_CACHE_DETERMINISTIC", "1") == "1",
+            replay=os.getenv("COMPLETION_CACHE_REPLAY", "0") == "1",
+            context_tokens=int(os.getenv("PROMPT_CONTEXT_TOKENS", 2000)),
+            stream=os.getenv("PROMPT_STREAM", "1") == "1")
+        window = float(os.getenv("PROMPT_BATCH_WINDOW", 0.05))
+        if window > 0:
+            prompt = BatchedPrompt(prompt, window)
     elif prompt == "human":
         prompt = HumanPrompt()
     else:
         raise ValueError(f"Invalid prompt '{prompt}': must be either 'openai' or 'human'")
 
-    levels.app(level, db, prompt).run()
+    if os.getenv("HEADLESS", "0") == "1":
+        delta_t = float(os.getenv("HEADLESS_DELTA_T", 1 / 60))
+        max_ticks = int(os.getenv("HEADLESS_MAX_TICKS", 0)) or None
+        app = levels.app(level, db, prompt, headless=True)
+        start = time.perf_counter()
+        ticks = asyncio.run(app.simulate(delta_t, lambda: levels.won(app), max_ticks))
+        elapsed = time.perf_counter() - start
+        result = "won" if levels.won(app) else "did not win"
+        print(f"Level '{level}' {result} after {ticks} ticks ({ticks * delta_t:.2f}s of game time) in {elapsed:.2f}s ({ticks / max(elapsed, 1e-9):.0f} ticks/s)")
+    else:
+        levels.app(level, db, prompt).run()
@@ -105,6 +105,13 @@ class TileLocator:
         tileset = Tileset.load(data["image"], data["tile_size"])
         return TileLocator(tileset, data["areas"])
 
+    @staticmethod
+    def load_areas(path: str) -> dict[str, tuple[int, int, int, int]]:
+        """Loads only the areas of a tile locator file, without loading its tileset"""
+        with open(path) as file:
+            data = json.load(file)
+        return {name: tuple(area) for name, area in data["areas"].items()}
+
 class Layers:
     """Stores the tilemap layers for a world"""
 
@@ -1,23 +1,42 @@
-from typing import Optional
+from typing import Callable, Optional
 
 from .interaction import Interaction
 from .object import ObjectType, Object
 from .character import Character, Direction
 from .action import Action, Idle, Walk, Interact, Ask, Answer
+from .change import Change, ObjectAdded, ObjectRemoved, InventoryChanged
 from .navigator import Navigator
 from .controller import Controller, ScriptedController, HumanController
 
 class World:
     """Holds all of the state of the world"""
 
-    def __init__(self, size: tuple[int, int]):
+    def __init__(self, size: tuple[int, int], hierarchical: bool = False):
+        """Hierarchical pathfinding scales better on large worlds, see Navigator"""
         self.size = size
 
         self.characters: dict[str, Character] = {}
         self.object_types: dict[str, ObjectType] = {}
         self.interactions: dict[str, Interaction] = dict()
         self.objects: dict[str, Object] = {}
-        self.navigator = Navigator(size, self.objects, self.characters)
+        self.navigator = Navigator(size, self.objects, self.characters, hierarchical=hierarchical)
+        self.listeners: list[Callable[[Change], None]] = []
+
+    def listen(self, listener: Callable[[Change], None]):
+        """Registers a function to be called with every change made to the world from now on"""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def notify(self, change: Change):
+        """Reports the given change to every listener"""
+        for listener in self.listeners:
+            listener(change)
+
+    def close(self):
+        """Cancels the work pending in the controllers of every character, e.g. when the app stops.
+        Ticking the world again resumes it"""
+        for character in self.characters.values():
+            character.controller.cancel()
 
     def make_impassable(self, area: tuple[int, int, int, int]):
         """Makes the given area impassable"""
@@ -26,7 +45,7 @@ class World:
     def add_character(self, id: str, controller: Controller, position: tuple[int, int], inventory: set[str] = set()):
         """Adds a new character to the world"""
         assert id not in self.characters, f"Character with id {id} already exists"
-        self.characters[id] = Character(id, controller, position, inventory)
+        self.characters[id] = Character(id, controller, position, set(inventory))
         controller.prepare(self, id)
 
     def add_object_type(self, type: str, size: tuple[int, int], interaction: Optional[Interaction] = None, occlude=True):
@@ -45,10 +64,49 @@ class World:
         assert id not in self.objects, f"Object with id {id} already exists"
         assert type in self.object_types, f"Object type {type} does not exist"
         self.objects[id] = Object(type, position, self.object_types[type])
+        self.navigator.add_object(id, self.objects[id])
+        self.notify(ObjectAdded(id, self.objects[id]))
+
+    def remove_object(self, id: str) -> Object:
+        """Removes the object with the given id from the world"""
+        assert id in self.objects, f"Object with id {id} does not exist"
+        self.navigator.remove_object(id)
+        obj = self.objects.pop(id)
+        self.notify(ObjectRemoved(id, obj))
+        return obj
+
+    def add_item(self, character_id: str, item_id: str):
+        """Adds an item to the inventory of the given character"""
+        inventory = self.characters[character_id].inventory
+        if item_id not in inventory:
+            inventory.add(item_id)
+            self.notify(InventoryChanged(character_id, item_id, True))
+
+    def remove_item(self, character_id: str, item_id: str):
+        """Removes an item from the inventory of the given character"""
+        inventory = self.characters[character_id].inventory
+        assert item_id in inventory, f"Character {character_id} does not have {item_id}"
+        inventory.remove(item_id)
+        self.notify(InventoryChanged(character_id, item_id, False))
 
     def tick(self, delta_t: float):
         """Updates the state of all characters in the world"""
+        actions = []
         for id, character in self.characters.items():
             action = character.tick(delta_t)
             if action is not None:
-                action.prepare(self, id)
+                actions.append((id, action))
+
+        # Plan the paths of every new walk together, so walks to the same target share the work.
+        # The results end up in the navigator's cache, where the actions find them when they are prepared
+        requests = []
+        for id, action in actions:
+            if isinstance(action, Walk):
+                requests.append((self.characters[id].position, action.target))
+            elif isinstance(action, Ask) and action.target_id in self.characters:
+                requests.append((self.characters[id].position, action.target_id))
+        if len(requests) > 1:
+            self.navigator.get_paths(requests)
+
+        for id, action in actions:
+            action.prepare(self, id)
@@ -0,0 +1,38 @@
+from .object import Object
+
+class Change:
+    """A change in the state of the world, reported to the world's listeners"""
+
+    def __repr__(self):
+        raise NotImplementedError
+
+class ObjectAdded(Change):
+    """An object was added to the world"""
+
+    def __init__(self, id: str, object: Object):
+        self.id = id
+        self.object = object
+
+    def __repr__(self):
+        return f"ObjectAdded(id={self.id})"
+
+class ObjectRemoved(Change):
+    """An object was removed from the world"""
+
+    def __init__(self, id: str, object: Object):
+        self.id = id
+        self.object = object
+
+    def __repr__(self):
+        return f"ObjectRemoved(id={self.id})"
+
+class InventoryChanged(Change):
+    """An item was added to or removed from a character's inventory"""
+
+    def __init__(self, character_id: str, item_id: str, added: bool):
+        self.character_id = character_id
+        self.item_id = item_id
+        self.added = added
+
+    def __repr__(self):
+        return f"InventoryChanged(character_id={self.character_id}, item_id={self.item_id}, added={self.added})"
@@ -16,6 +16,8 @@ class Character:
         self.inventory = inventory
 
         self.action = None
+        # Number of actions which failed with an error
+        self.failures = 0
         self.animated_position = tuple(float(x) for x in position)
         self.animated_direction = Direction.SOUTH
 
@@ -24,6 +26,7 @@ class Character:
         if self.action is None or self.action.tick(delta_t):
             if self.action is not None:
                 if self.action.error:
+                    self.failures += 1
                     logging.info(f"Character '{self.id}' failed to do {self.action} with error '{self.action.error}'")
                 elif not isinstance(self.action, Idle):
                     logging.info(f"Character '{self.id}' finished doing {self.action}")
@@ -20,6 +20,10 @@ class Controller:
         """Called when another character asks a question. Should return an answer, or empty string if asker should wait another turn"""
         return "I don't like talking..."
 
+    def cancel(self):
+        """Called when the world is closed. Should stop any work still pending for the next action"""
+        pass
+
 class ScriptedController(Controller):
     def __init__(self, actions = []):
         self.actions = actions
@@ -0,0 +1,286 @@
+import heapq
+
+from typing import Callable, Optional
+
+START = -1
+GOAL = -2
+
+class HierarchicalAStar:
+    """Hierarchical A* (HPA*) over a grid split into square clusters.
+    Every passable cell on the border of a cluster with a passable neighbor across it is a transition, and the
+    cheapest paths between the transitions of each cluster are cached, so searching the graph of transitions
+    finds paths as cheap as a flat search would. Clusters are rebuilt lazily, after cells in or next to them change"""
+
+    def __init__(self, size: tuple[int, int], cost: Callable[[int, int], Optional[int]], cluster_size: int = 16):
+        """cost returns how much it costs to step into a cell (at least 1), or None if the cell can't be entered"""
+        self.size = size
+        self.cost = cost
+        self.cluster_size = cluster_size
+
+        # Costs of the passable cells of each cluster, transitions of each built cluster, and the edges leaving each transition
+        self.costs = dict[tuple[int, int], dict[tuple[int, int], int]]()
+        self.transitions = dict[tuple[int, int], list[tuple[int, int]]]()
+        self.edges = dict[tuple[int, int], list[tuple[tuple[int, int], int]]]()
+
+    def invalidate(self, area: tuple[int, int, int, int]):
+        """Called when the cost of the cells in the given area changes"""
+        x, y, w, h = area
+        cs = self.cluster_size
+
+        # Transitions depend on the cells right across the border too
+        for i in range(max(x - 1, 0) // cs, min(x + w, self.size[0] - 1) // cs + 1):
+            for j in range(max(y - 1, 0) // cs, min(y + h, self.size[1] - 1) // cs + 1):
+                self.costs.pop((i, j), None)
+                for transition in self.transitions.pop((i, j), []):
+                    self.edges.pop(transition)
+
+    def cluster(self, cell: tuple[int, int]) -> tuple[int, int]:
+        return (cell[0] // self.cluster_size, cell[1] // self.cluster_size)
+
+    def search(self, origin: tuple[int, int], target: tuple[int, int], target_area: Optional[tuple[int, int, int, int]] = None) -> Optional[list[tuple[int, int]]]:
+        """Returns the cheapest cells from origin to target (both included), or None if target can't be reached.
+        If target_area is given, its cells can be entered at a cost of 1, no matter what cost says about them"""
+        if origin == target:
+            return [origin]
+        if target_area is not None and self.__inside(origin, target_area):
+            return [origin] + self.__walk_inside(origin, target)
+
+        # Connect the origin to the transitions of its cluster, and to those of the clusters next to it if it's on a border
+        seeds = {self.cluster(origin): [(origin, 0)]}
+        for cell in self.__neighbors(origin):
+            if self.cluster(cell) != self.cluster(origin) and self.cost(*cell) is not None:
+                seeds.setdefault(self.cluster(cell), []).append((cell, self.cost(*cell)))
+
+        origin_dist = dict[tuple[int, int], int]()
+        origin_parent = dict[tuple[int, int], Optional[tuple[int, int]]]()
+        for cluster, cluster_seeds in seeds.items():
+            dist, parent = self.__local(cluster, cluster_seeds)
+            origin_dist.update(dist)
+            origin_parent.update(parent)
+        start_edges = [(cell, origin_dist[cell]) for cluster in seeds for cell in self.__transitions(cluster) if cell in origin_dist]
+
+        best_exit = None
+        for cell, dist in origin_dist.items():
+            exit = self.__exit(cell, target, target_area)
+            if exit is not None and (best_exit is None or dist + exit < best_exit[1]):
+                best_exit = (cell, dist + exit)
+        if best_exit is not None:
+            start_edges.append((GOAL, best_exit[1]))
+
+        # Find how much it costs to reach the target from the transitions of the clusters next to it
+        goal_dist = dict[tuple[int, int], int]()
+        goal_parent = dict[tuple[int, int], Optional[tuple[int, int]]]()
+        for cluster in self.__goal_clusters(target, target_area):
+            exits = []
+            for cell in self.__cells(cluster):
+                if self.cost(*cell) is not None:
+                    exit = self.__exit(cell, target, target_area)
+                    if exit is not None:
+                        exits.append((cell, exit))
+            dist, parent = self.__local(cluster, exits, reverse=True)
+            for cell in self.__transitions(cluster):
+                if cell in dist and dist[cell] < goal_dist.get(cell, dist[cell] + 1):
+                    goal_dist[cell] = dist[cell]
+                    goal_parent.update(self.__chain(parent, cell))
+
+        abstract = self.__abstract_search(start_edges, goal_dist, target)
+        if abstract is None:
+            return None
+
+        # Refine the abstract path into cells
+        last = best_exit[0] if abstract[0] == GOAL else abstract[0] # type: ignore
+        path = self.__chain_path(origin_parent, last)
+        if path[0] != origin:
+            path.insert(0, origin)
+        if abstract[0] != GOAL:
+            for previous, current in zip(abstract, abstract[1:-1]):
+                if self.cluster(previous) != self.cluster(current):
+                    path.append(current)
+                else:
+                    _, parent = self.__local(self.cluster(previous), [(previous, 0)])
+                    path += self.__chain_path(parent, current)[1:]
+            last = abstract[-2]
+            while goal_parent[last] is not None:
+                last = goal_parent[last] # type: ignore
+                path.append(last)
+
+        # Step from the last cell into the target
+        best = None
+        for cell in self.__neighbors(last):
+            if target_area is not None and self.__inside(cell, target_area):
+                cost = 1 + abs(cell[0] - target[0]) + abs(cell[1] - target[1])
+            elif target_area is None and cell == target:
+                cost = 0
+            else:
+                continue
+            if best is None or cost < best[1]:
+                best = (cell, cost)
+        if best is None:
+            return path
+        return path + [best[0]] + self.__walk_inside(best[0], target)
+
+    def __abstract_search(self, start_edges: list, goal_dist: dict[tuple[int, int], int], target: tuple[int, int]) -> Optional[list]:
+        """A* over the transitions, returning the nodes after START up to GOAL"""
+        g_score = {START: 0}
+        parent = {START: None}
+        closed = set()
+        counter = 0
+        open_set = [(0, 0, 0, START)]
+        while open_set:
+            _, _, _, current = heapq.heappop(open_set)
+            if current in closed:
+                continue
+            closed.add(current)
+
+            if current == GOAL:
+                path = []
+                while current != START:
+                    path.append(current)
+                    current = parent[current]
+                return path[::-1]
+
+            if current == START:
+                edges = start_edges
+            else:
+                edges = self.__edges(current)
+                if current in goal_dist:
+                    edges = edges + [(GOAL, goal_dist[current])]
+
+            for neighbor, cost in edges:
+                tentative_g_score = g_score[current] + cost
+                if neighbor in closed or tentative_g_score >= g_score.get(neighbor, tentative_g_score + 1):
+                    continue
+                g_score[neighbor] = tentative_g_score
+                parent[neighbor] = current
+                h = 0 if neighbor == GOAL else abs(neighbor[0] - target[0]) + abs(neighbor[1] - target[1])
+                counter += 1
+                # Among equally promising nodes, prefer the ones furthest along
+                heapq.heappush(open_set, (tentative_g_score + h, -tentative_g_score, counter, neighbor))
+        return None
+
+    def __edges(self, transition: tuple[int, int]) -> list[tuple[tuple[int, int], int]]:
+        self.__transitions(self.cluster(transition))
+        return self.edges[transition]
+
+    def __transitions(self, cluster: tuple[int, int]) -> list[tuple[int, int]]:
+        """Returns the transitions of the given cluster, building it if needed"""
+        if cluster in self.transitions:
+            return self.transitions[cluster]
+
+        transitions = []
+        x, y, w, h = self.__bounds(cluster)
+        for cell in self.__cells(cluster):
+            if cell[0] not in (x, x + w - 1) and cell[1] not in (y, y + h - 1):
+                continue
+            if self.cost(*cell) is None:
+                continue
+            crossings = [(neighbor, self.cost(*neighbor)) for neighbor in self.__neighbors(cell) if self.cluster(neighbor) != cluster and self.cost(*neighbor) is not None]
+            if crossings:
+                transitions.append(cell)
+                self.edges[cell] = crossings
+
+        for transition in transitions:
+            dist, _ = self.__local(cluster, [(transition, 0)])
+            self.edges[transition] += [(cell, dist[cell]) for cell in transitions if cell != transition and cell in dist]
+
+        self.transitions[cluster] = transitions
+        return transitions
+
+    def __local(self, cluster: tuple[int, int], seeds: list[tuple[tuple[int, int], int]], reverse: bool = False) -> tuple[dict, dict]:
+        """Dijkstra restricted to a cluster, from the given seeds. When reversed, the costs are those of walking towards the seeds"""
+        costs = self.__costs(cluster)
+        dist = dict[tuple[int, int], int]()
+        parent = dict[tuple[int, int], Optional[tuple[int, int]]]()
+        open_set = []
+        for cell, cost in seeds:
+            if cost < dist.get(cell, cost + 1):
+                dist[cell] = cost
+                parent[cell] = None
+                heapq.heappush(open_set, (cost, cell))
+
+        while open_set:
+            cost, current = heapq.heappop(open_set)
+            if cost > dist[current]:
+                continue
+            x, y = current
+            for neighbor in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                neighbor_cost = costs.get(neighbor)
+                if neighbor_cost is None:
+                    continue
+                tentative = cost + (costs[current] if reverse else neighbor_cost)
+                if tentative < dist.get(neighbor, tentative + 1):
+                    dist[neighbor] = tentative
+                    parent[neighbor] = current
+                    heapq.heappush(open_set, (tentative, neighbor))
+        return dist, parent
+
+    def __costs(self, cluster: tuple[int, int]) -> dict[tuple[int, int], int]:
+        """Returns the cost of stepping into each passable cell of the given cluster"""
+        if cluster not in self.costs:
+            self.costs[cluster] = {}
+            for cell in self.__cells(cluster):
+                cost = self.cost(*cell)
+                if cost is not None:
+                    self.costs[cluster][cell] = cost
+        return self.costs[cluster]
+
+    def __goal_clusters(self, target: tuple[int, int], target_area: Optional[tuple[int, int, int, int]]) -> set[tuple[int, int]]:
+        """Returns the clusters with cells from which the target can be stepped into"""
+        x, y, w, h = target_area if target_area is not None else target + (1, 1)
+        return set(self.cluster((i, j)) for i in range(max(x - 1, 0), min(x + w + 1, self.size[0])) for j in range(max(y - 1, 0), min(y + h + 1, self.size[1])))
+
+    def __exit(self, cell: tuple[int, int], target: tuple[int, int], target_area: Optional[tuple[int, int, int, int]]) -> Optional[int]:
+        """Returns how much it costs to reach target from a cell outside of it by stepping into it"""
+        best = None
+        for neighbor in self.__neighbors(cell):
+            if target_area is not None and self.__inside(neighbor, target_area):
+                cost = 1 + abs(neighbor[0] - target[0]) + abs(neighbor[1] - target[1])
+            elif target_area is None and neighbor == target:
+                cost = self.cost(*neighbor)
+            else:
+                continue
+            if cost is not None and (best is None or cost < best):
+                best = cost
+        return best
+
+    def __walk_inside(self, cell: tuple[int, int], target: tuple[int, int]) -> list[tuple[int, int]]:
+        """Cells walked from cell to target, through the inside of the target's area"""
+        path = []
+        x, y = cell
+        while x != target[0]:
+            x += 1 if target[0] > x else -1
+            path.append((x, y))
+        while y != target[1]:
+            y += 1 if target[1] > y else -1
+            path.append((x, y))
+        return path
+
+    def __chain(self, parent: dict, cell: tuple[int, int]) -> dict:
+        chain = {}
+        while cell is not None:
+            chain[cell] = parent[cell]
+            cell = parent[cell]
+        return chain
+
+    def __chain_path(self, parent: dict, cell: tuple[int, int]) -> list[tuple[int, int]]:
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = parent[cell]
+        return path[::-1]
+
+    def __bounds(self, cluster: tuple[int, int]) -> tuple[int, int, int, int]:
+        cs = self.cluster_size
+        x, y = cluster[0] * cs, cluster[1] * cs
+        return (x, y, min(cs, self.size[0] - x), min(cs, self.size[1] - y))
+
+    def __cells(self, cluster: tuple[int, int]) -> list[tuple[int, int]]:
+        x, y, w, h = self.__bounds(cluster)
+        return [(i, j) for i in range(x, x + w) for j in range(y, y + h)]
+
+    def __inside(self, cell: tuple[int, int], area: tuple[int, int, int, int]) -> bool:
+        return area[0] <= cell[0] < area[0] + area[2] and area[1] <= cell[1] < area[1] + area[3]
+
+    def __neighbors(self, cell: tuple[int, int]) -> list[tuple[int, int]]:
+        x, y = cell
+        return [(i, j) for i, j in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)) if 0 <= i < self.size[0] and 0 <= j < self.size[1]]
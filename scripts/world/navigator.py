@@ -1,7 +1,14 @@
+import numpy as np
+
+from array import array
+from collections import OrderedDict, defaultdict, deque
 from typing import Union, Optional
 
 from .object import Object
 from .character import Character
+from .pathfinding import AStar
+from .hierarchical import HierarchicalAStar
+from .regions import Regions
 
 def is_removeable(objects: dict[str, Object], occluded: str):
     if occluded not in objects:
@@ -10,111 +17,310 @@ def is_removeable(objects: dict[str, Object], occluded: str):
     return interaction is None or interaction.removeable
 
 class Node:
-    def __init__(self):
-        self.occluded = ""
-        self.g_score = 0.0
-        self.f_score = 0.0
-        self.parent: Optional[tuple[int, int]] = None
+    """Debugging view of a single cell, see Navigator.node"""
+
+    def __init__(self, occluded: str, g_score: float, parent: Optional[tuple[int, int]]):
+        self.occluded = occluded
+        self.g_score = g_score
+        self.parent = parent
+
+    def __repr__(self):
+        return f"Node(occluded={self.occluded}, g_score={self.g_score}, parent={self.parent})"
+
+class PathCache:
+    """Bounded LRU cache of get_path results"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict[tuple, Union[str, list[tuple[int, int]]]]()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[Union[str, list[tuple[int, int]]]]:
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: tuple, result: Union[str, list[tuple[int, int]]]):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
 
 class Navigator:
-    def __init__(self, size: tuple[int, int], objects: dict[str, Object], characters: dict[str, Character]):
+    def __init__(self, size: tuple[int, int], objects: dict[str, Object], characters: dict[str, Character], cache_size: int = 256, hierarchical: bool = False):
+        """In hierarchical mode, searches go through a HierarchicalAStar instead of a flat A*, which scales better on large worlds"""
         self.size = size
         self.objects = objects
         self.characters = characters
 
+        # Each cell holds the interned id of the object occluding it, 0 meaning it's free.
+        # The flat buffer is quick to read cell by cell, and the NumPy view over it writes whole areas at once
+        self.ids = [""]
+        self.id_index = {"": 0}
+        self.cells = array("i", [0]) * (size[0] * size[1])
+        self.occluders = np.frombuffer(self.cells, dtype=np.int32).reshape(size)
         self.seen_objects = dict[str, tuple[int, int, int, int]]()
-        self.nodes = [[Node() for _ in range(size[1])] for _ in range(size[0])]
+        self.events = list[tuple[str, Optional[tuple[int, int, int, int]]]]()
+
+        # Bumped whenever occlusion changes, which invalidates every cached path
+        self.version = 0
+        self.cache = PathCache(cache_size)
+
+        # Distance fields to interactable objects, built on demand, which almost every walk heads to
+        self.fields = dict[str, np.ndarray]()
+        self.engine = AStar(size)
+
+        # Stepping into a removeable object costs more than any path around it could
+        self.penalty = size[0] * size[1] + 1
+        self.hierarchy = None
+        if hierarchical:
+            self.hierarchy = HierarchicalAStar(size, self.__cost(""))
+
+        # Regions connected through free cells only, and through free cells or removeable objects
+        self.removeable = set[int]()
+        self.strict_regions = Regions(size, lambda: self.occluders == 0)
+        self.relaxed_regions = Regions(size, lambda: (self.occluders == 0) | np.isin(self.occluders, list(self.removeable)))
+
+    def intern(self, what: str) -> int:
+        """Returns the id stored in the cells occluded by the given object"""
+        if what not in self.id_index:
+            self.id_index[what] = len(self.ids)
+            self.ids.append(what)
+        return self.id_index[what]
+
+    def occluded(self, cell: tuple[int, int]) -> str:
+        """Returns the id of the object occluding the given cell, or "" if it's free"""
+        return self.ids[self.cells[cell[0] * self.size[1] + cell[1]]]
+
+    def node(self, cell: tuple[int, int]) -> Node:
+        """Returns a view of the given cell and its state in the last search, for debugging"""
+        g_score, parent = self.engine.node(cell)
+        return Node(self.occluded(cell), g_score, parent)
 
     def occlude(self, what: str, area: tuple[int, int, int, int]):
         x, y, w, h = area
-        for i in range(x, x + w):
-            for j in range(y, y + h):
-                assert self.nodes[i][j].occluded == ""
-                self.nodes[i][j].occluded = what
+        occluder = self.intern(what)
+        cells = self.occluders[x:x + w, y:y + h]
+        assert not cells.any()
+        cells[...] = occluder
+        self.invalidate(area)
+
+        self.strict_regions.invalidate()
+        if is_removeable(self.objects, what):
+            self.removeable.add(occluder)
+        else:
+            self.relaxed_regions.invalidate()
     
     def unocclude(self, what: str, area: tuple[int, int, int, int]):
         x, y, w, h = area
-        for i in range(x, x + w):
-            for j in range(y, y + h):
-                assert self.nodes[i][j].occluded == what
-                self.nodes[i][j].occluded = ""
+        occluder = self.intern(what)
+        cells = self.occluders[x:x + w, y:y + h]
+        assert (cells == occluder).all()
+        cells[...] = 0
+        self.invalidate(area)
+
+        self.strict_regions.open(area)
+        if occluder in self.removeable:
+            self.removeable.remove(occluder)
+        else:
+            self.relaxed_regions.open(area)
+
+    def invalidate(self, area: tuple[int, int, int, int]):
+        """Called whenever occlusion changes in the given area"""
+        self.version += 1
+        self.cache.clear()
+        self.fields.clear()
+        if self.hierarchy is not None:
+            self.hierarchy.invalidate(area)
+
+    def add_object(self, obj_id: str, obj: Object):
+        """Called when an object is added to the world"""
+        self.fields.pop(obj_id, None)
+        if obj.occlude:
+            self.events.append((obj_id, obj.position + obj.size))
+
+    def remove_object(self, obj_id: str):
+        """Called when an object is removed from the world"""
+        self.fields.pop(obj_id, None)
+        self.events.append((obj_id, None))
 
     def update_occlusion(self):
-        removed = []
-        for obj_id in self.seen_objects:
-            if obj_id not in self.objects:
-                x, y, w, h = self.seen_objects[obj_id]
-                removed.append(obj_id)
-                self.unocclude(obj_id, (x, y, w, h))
-        for obj_id in removed:
-            self.seen_objects.pop(obj_id)
+        """Applies the object additions and removals which happened since the last call"""
+        for obj_id, area in self.events:
+            if area is not None:
+                self.seen_objects[obj_id] = area
+                self.occlude(obj_id, area)
+            elif obj_id in self.seen_objects:
+                self.unocclude(obj_id, self.seen_objects.pop(obj_id))
+        self.events.clear()
 
+    def connected(self, regions: Regions, origin: tuple[int, int], target: str, target_pos: tuple[int, int]) -> bool:
+        """Checks whether there's a path from origin to the given target through the passable cells of regions"""
+        if origin == target_pos:
+            return True
+        origin_cells = [origin] + self.__neighbors(origin)
+
+        if target in self.seen_objects:
+            # Targets which occlude can be stepped into from any passable cell around them
+            x, y, w, h = self.seen_objects[target]
+            cells = [(i, j) for i in range(x, x + w) for j in range(y, y + h)]
+            if any(cell in cells for cell in origin_cells):
+                return True
+            target_cells = [neighbor for cell in cells for neighbor in self.__neighbors(cell)]
+        else:
+            target_cells = [target_pos]
+
+        origin_regions = set(regions.region(cell) for cell in origin_cells) - {-1}
+        return any(regions.region(cell) in origin_regions for cell in target_cells)
+
+    def reachable(self, origin: tuple[int, int]) -> list[str]:
+        """Returns the ids of the objects and characters which can be walked to from origin right now"""
+        self.update_occlusion()
+        result = []
         for obj_id, obj in self.objects.items():
-            if obj_id not in self.seen_objects and obj.occlude:
-                self.seen_objects[obj_id] = obj.position + obj.size
-                self.occlude(obj_id, obj.position + obj.size)
+            if self.connected(self.strict_regions, origin, obj_id, obj.position):
+                result.append(obj_id)
+        for chr_id, character in self.characters.items():
+            if character.position != origin and self.connected(self.strict_regions, origin, chr_id, character.position):
+                result.append(chr_id)
+        return result
 
-    def heuristic(self, node: tuple[int, int], target: tuple[int, int]) -> int:
-        return abs(node[0] - target[0]) + abs(node[1] - target[1])
+    def __neighbors(self, cell: tuple[int, int]) -> list[tuple[int, int]]:
+        x, y = cell
+        return [(i, j) for i, j in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)) if 0 <= i < self.size[0] and 0 <= j < self.size[1]]
+
+    def step_cost(self, occluder: int, target: int) -> Optional[int]:
+        """Cost of stepping into a cell occluded by the object with the given interned id when walking to target.
+        Removeable objects can be crossed, but only when there's no way around them"""
+        if occluder == 0 or occluder == target:
+            return 1
+        if occluder in self.removeable:
+            return self.penalty
+        return None
+
+    def __cost(self, target: str):
+        """Returns the cost of stepping into each cell when walking to target, as expected by the search engines"""
+        target_id = self.id_index.get(target, -1)
+        height = self.size[1]
+        return lambda x, y: self.step_cost(self.cells[x * height + y], target_id)
 
     def get_path(self, origin: tuple[int, int], target: str) -> Union[str, list[tuple[int, int]]]:
         if target not in self.objects and target not in self.characters:
             return f"No such object or character '{target}'"
         self.update_occlusion()
 
-        result = self.__get_path(origin, target, lambda node: node.occluded != "" and node.occluded != target)
-        if result is not None:
-            return result
-        
-        result = self.__get_path(origin, target, lambda node: node.occluded != "" and node.occluded != target and not is_removeable(self.objects, node.occluded))
-        if result is not None:
-            # Figure out which node is blocking the path
-            for node in result:
-                obj_id = self.nodes[node[0]][node[1]].occluded
-                if obj_id != "" and obj_id != target:
-                    return f"Cannot reach '{target}' because '{obj_id}' is blocking the path"
-            return result
-
-        return f"'{target}' is unreacheable"
-
-    def __get_path(self, origin: tuple[int, int], target: str, occluded_filter) -> Optional[list[tuple[int, int]]]:
         if target not in self.objects:
             target_pos = self.characters[target].position
         else:
             target_pos = self.objects[target].position
 
-        open_set = [origin]
-        for x in range(self.size[0]):
-            for y in range(self.size[1]):
-                self.nodes[x][y].g_score = float("inf")
-                self.nodes[x][y].f_score = float("inf")
-                self.nodes[x][y].parent = None
-
-        self.nodes[origin[0]][origin[1]].g_score = 0.0
-        self.nodes[origin[0]][origin[1]].f_score = self.heuristic(origin, target_pos)
-
-        while open_set:
-            current = min(open_set, key=lambda node: self.nodes[node[0]][node[1]].f_score)
-            if current == target_pos:
-                path = []
-                while current:
-                    if not occluded_filter(self.nodes[current[0]][current[1]]) and self.nodes[current[0]][current[1]].occluded != target and current != target_pos:
-                        path.append(current)
-                    current = self.nodes[current[0]][current[1]].parent
-                return path[::-1]
-
-            open_set.remove(current)
-            for x, y in [(current[0] + 1, current[1]), (current[0] - 1, current[1]), (current[0], current[1] + 1), (current[0], current[1] - 1)]:
-                if x < 0 or y < 0 or x >= self.size[0] or y >= self.size[1]:
-                    continue
-                if occluded_filter(self.nodes[x][y]):
-                    continue
-                tentative_g_score = self.nodes[current[0]][current[1]].g_score + 1
-                if tentative_g_score < self.nodes[x][y].g_score:
-                    self.nodes[x][y].parent = current
-                    self.nodes[x][y].g_score = tentative_g_score
-                    self.nodes[x][y].f_score = tentative_g_score + self.heuristic((x, y), target_pos)
-                    if (x, y) not in open_set:
-                        open_set.append((x, y))
+        # Paths are handed out as copies, since walking consumes them
+        key = (origin, target, target_pos, self.version)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.__get_path(origin, target, target_pos)
+            self.cache.put(key, result)
+        return result if isinstance(result, str) else list(result)
 
-        return None
+    def get_paths(self, requests: list[tuple[tuple[int, int], str]]) -> list[Union[str, list[tuple[int, int]]]]:
+        """Plans several walks at once, given as (origin, target) pairs, and returns their results in the same order.
+        Walks heading to the same target share a single distance field instead of searching separately"""
+        if self.hierarchy is not None:
+            # Building distance fields walks the whole world, which is what the hierarchical mode avoids
+            return [self.get_path(origin, target) for origin, target in requests]
+        self.update_occlusion()
+
+        by_target = defaultdict[str, list[int]](list)
+        for i, (_, target) in enumerate(requests):
+            by_target[target].append(i)
+
+        results: list[Union[str, list[tuple[int, int]]]] = [""] * len(requests)
+        for target, indices in by_target.items():
+            if target not in self.objects and target not in self.characters:
+                # Gone from the world, get_path reports it
+                pass
+            elif target in self.fields or len(indices) > 1:
+                target_pos = self.objects[target].position if target in self.objects else self.characters[target].position
+                field = self.fields[target] if target in self.fields else self.distance_field(target, target_pos)
+                for i in indices:
+                    origin = requests[i][0]
+                    key = (origin, target, target_pos, self.version)
+                    if key not in self.cache.entries:
+                        path = self.descend(field, origin, target_pos)
+                        if path is not None:
+                            self.cache.put(key, [node for node in path if self.occluded(node) == "" and node != target_pos])
+
+            # Walks which the field couldn't answer still need a search, to find out what's in the way
+            for i in indices:
+                results[i] = self.get_path(*requests[i])
+        return results
+
+    def flow_field(self, target: str) -> Optional[np.ndarray]:
+        """Returns the distance field to the given object if it's interactable, building it if needed.
+        Fields are kept until occlusion changes"""
+        if target not in self.fields:
+            if target not in self.objects or self.objects[target].interaction is None:
+                return None
+            self.fields[target] = self.distance_field(target, self.objects[target].position)
+        return self.fields[target]
+
+    def distance_field(self, target: str, target_pos: tuple[int, int]) -> np.ndarray:
+        """Returns the walking distance from every cell to target, or -1 for cells which can't reach it without going through other objects"""
+        width, height = self.size
+        passable = (0, self.id_index.get(target, -1))
+        field = array("i", [-1]) * (width * height)
+        if self.cells[target_pos[0] * height + target_pos[1]] in passable:
+            field[target_pos[0] * height + target_pos[1]] = 0
+            queue = deque([target_pos])
+            while queue:
+                cell = queue.popleft()
+                distance = field[cell[0] * height + cell[1]] + 1
+                for x, y in self.__neighbors(cell):
+                    if field[x * height + y] == -1 and self.cells[x * height + y] in passable:
+                        field[x * height + y] = distance
+                        queue.append((x, y))
+        return np.frombuffer(field, dtype=np.int32).reshape(self.size)
+
+    def descend(self, field: np.ndarray, origin: tuple[int, int], target_pos: tuple[int, int]) -> Optional[list[tuple[int, int]]]:
+        """Follows a distance field downhill from origin, returning the cells up to target_pos (both included), or None if it's unreachable"""
+        path = [origin]
+        while path[-1] != target_pos:
+            reached = [cell for cell in self.__neighbors(path[-1]) if field[cell] != -1]
+            if not reached:
+                return None
+            path.append(min(reached, key=lambda cell: field[cell]))
+        return path
+
+    def __get_path(self, origin: tuple[int, int], target: str, target_pos: tuple[int, int]) -> Union[str, list[tuple[int, int]]]:
+        if not self.connected(self.relaxed_regions, origin, target, target_pos):
+            return f"'{target}' is unreacheable"
+
+        if self.hierarchy is not None:
+            # Building distance fields walks the whole world, which is what the hierarchical mode avoids
+            path = self.hierarchy.search(origin, target_pos, self.seen_objects.get(target))
+        else:
+            # Walks to interactable objects just go downhill on the object's distance field
+            field = self.flow_field(target)
+            if field is not None:
+                path = self.descend(field, origin, target_pos)
+                if path is not None:
+                    return [node for node in path if self.occluded(node) == "" and node != target_pos]
+
+            path = self.engine.search(origin, target_pos, self.__cost(target))
+        if path is None:
+            return f"'{target}' is unreacheable"
+
+        # The cheapest path only goes through removeable objects if it can't avoid them - the first one is blocking it
+        for node in path[1:]:
+            obj_id = self.occluded(node)
+            if obj_id != "" and obj_id != target:
+                return f"Cannot reach '{target}' because '{obj_id}' is blocking the path"
+
+        return [node for node in path if self.occluded(node) == "" and node != target_pos]
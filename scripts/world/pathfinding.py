@@ -0,0 +1,87 @@
+import heapq
+
+from array import array
+from typing import Callable, Optional
+
+class AStar:
+    """A* search over a grid, reusing flat score buffers between searches"""
+
+    def __init__(self, size: tuple[int, int]):
+        self.size = size
+        count = size[0] * size[1]
+
+        # Cells whose stamp isn't the current generation haven't been visited by the current search,
+        # which saves us from resetting every buffer before each search
+        self.generation = 0
+        self.stamp = array("I", [0]) * count
+        self.closed = array("I", [0]) * count
+        self.g_score = array("i", [0]) * count
+        self.parent = array("i", [-1]) * count
+        self.order = array("I", [0]) * count
+
+    @staticmethod
+    def heuristic(node: tuple[int, int], target: tuple[int, int]) -> int:
+        return abs(node[0] - target[0]) + abs(node[1] - target[1])
+
+    def node(self, cell: tuple[int, int]) -> tuple[float, Optional[tuple[int, int]]]:
+        """Returns the g score and parent of the given cell in the last search"""
+        index = cell[0] * self.size[1] + cell[1]
+        if self.generation == 0 or self.stamp[index] != self.generation:
+            return (float("inf"), None)
+        parent = self.parent[index]
+        return (self.g_score[index], None if parent == -1 else divmod(parent, self.size[1]))
+
+    def search(self, origin: tuple[int, int], target: tuple[int, int], cost: Callable[[int, int], Optional[int]]) -> Optional[list[tuple[int, int]]]:
+        """Returns the cheapest cells from origin to target (both included), or None if target can't be reached.
+        cost returns how much it costs to step into a cell (at least 1), or None if the cell can't be entered.
+        Ties between cells with the same f score are broken by the order in which they were first opened"""
+        width, height = self.size
+        tx, ty = target
+
+        self.generation += 1
+        generation = self.generation
+        stamp, closed, g_score, parent, order = self.stamp, self.closed, self.g_score, self.parent, self.order
+
+        start = origin[0] * height + origin[1]
+        stamp[start] = generation
+        g_score[start] = 0
+        parent[start] = -1
+        order[start] = 0
+        opened = 1
+        open_set = [(self.heuristic(origin, target), 0, start)]
+
+        while open_set:
+            _, _, current = heapq.heappop(open_set)
+            if closed[current] == generation:
+                # Stale entry, left behind when the cell's score improved
+                continue
+            closed[current] = generation
+
+            cx, cy = divmod(current, height)
+            if cx == tx and cy == ty:
+                path = []
+                while current != -1:
+                    path.append(divmod(current, height))
+                    current = parent[current]
+                return path[::-1]
+
+            current_g_score = g_score[current]
+            for x, y in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+                if x < 0 or y < 0 or x >= width or y >= height:
+                    continue
+                step = cost(x, y)
+                if step is None:
+                    continue
+                tentative_g_score = current_g_score + step
+                neighbor = x * height + y
+                if stamp[neighbor] != generation:
+                    stamp[neighbor] = generation
+                    order[neighbor] = opened
+                    opened += 1
+                elif tentative_g_score >= g_score[neighbor] or closed[neighbor] == generation:
+                    continue
+                parent[neighbor] = current
+                g_score[neighbor] = tentative_g_score
+                heapq.heappush(open_set, (tentative_g_score + abs(x - tx) + abs(y - ty), order[neighbor], neighbor))
+
+        return None
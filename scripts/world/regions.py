@@ -0,0 +1,75 @@
+import numpy as np
+import scipy.ndimage
+
+from array import array
+from typing import Callable
+
+class Regions:
+    """Labels the connected regions of passable cells in a grid, using union-find.
+    Cells becoming passable are merged in place, while cells becoming impassable may split a region,
+    so they mark the labels dirty and the next lookup rebuilds them"""
+
+    def __init__(self, size: tuple[int, int], passable: Callable[[], np.ndarray]):
+        """passable returns a boolean grid telling which cells are passable"""
+        self.size = size
+        self.passable = passable
+        self.parent = array("i", [-1]) * (size[0] * size[1])
+        self.dirty = True
+
+    def invalidate(self):
+        """Called when cells become impassable"""
+        self.dirty = True
+
+    def open(self, area: tuple[int, int, int, int]):
+        """Called when the cells in the given area become passable"""
+        if self.dirty:
+            return
+
+        x, y, w, h = area
+        height = self.size[1]
+        for i in range(x, x + w):
+            for j in range(y, y + h):
+                if self.parent[i * height + j] == -1:
+                    self.parent[i * height + j] = i * height + j
+        for i in range(x, x + w):
+            for j in range(y, y + h):
+                self.__join_neighbors(i, j)
+
+    def rebuild(self):
+        """Labels every cell from scratch"""
+        labels, count = scipy.ndimage.label(self.passable())
+        labels = labels.ravel()
+
+        # Every cell of a region points straight at the region's first cell
+        first = np.full(count + 1, labels.size, dtype=np.int64)
+        np.minimum.at(first, labels, np.arange(labels.size))
+        parent = np.frombuffer(self.parent, dtype=np.int32)
+        parent[:] = np.where(labels > 0, first[labels], -1)
+        self.dirty = False
+
+    def region(self, cell: tuple[int, int]) -> int:
+        """Returns the label of the region containing the given cell, or -1 if it's impassable"""
+        if self.dirty:
+            self.rebuild()
+        index = cell[0] * self.size[1] + cell[1]
+        if self.parent[index] == -1:
+            return -1
+        return self.__find(index)
+
+    def __join_neighbors(self, i: int, j: int):
+        width, height = self.size
+        for x, y in ((i + 1, j), (i - 1, j), (i, j + 1), (i, j - 1)):
+            if 0 <= x < width and 0 <= y < height and self.parent[x * height + y] != -1:
+                self.__union(i * height + j, x * height + y)
+
+    def __find(self, index: int) -> int:
+        parent = self.parent
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def __union(self, a: int, b: int):
+        a, b = self.__find(a), self.__find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The game's modules live in scripts, and its assets are loaded relative to the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+os.chdir(ROOT)
@@ -0,0 +1,29 @@
+import asyncio
+import levels
+
+from ai.cache import Cache
+from ai.database import DumbDatabase, LocalDatabase, stub_embed
+from ai.prompt import Prompt, StubPrompt
+
+class ScriptedPrompt(Prompt):
+    """Prompt whose plan is simple enough for StepInterpreter to carry out on its own"""
+
+    async def plan(self, context, inventory, goal, first_task=None):
+        return ["Walk to key", "Pick up key with hand", "Walk to door", "Open door with key", "Walk to goal", "Win by interacting with goal using hand"]
+
+def test_headless_level_is_won():
+    app = levels.app("pickup_and_open", DumbDatabase(), ScriptedPrompt(), headless=True)
+    assert app.headless and app.renderer is None
+
+    ticks = asyncio.run(app.simulate(1 / 60, lambda: levels.won(app), 10000))
+    assert levels.won(app)
+    assert 0 < ticks == app.ticks < 10000
+
+def test_stub_prompt_wins_offline():
+    db = LocalDatabase("cl100k_base", "model", Cache("embeddings"), stub_embed)
+    app = levels.app("pickup_and_open", db, StubPrompt(), headless=True)
+
+    asyncio.run(app.simulate(1 / 60, lambda: levels.won(app), 10000))
+    assert levels.won(app)
+    # The door is only opened once walking to the goal found it in the way
+    assert sum(character.failures for character in app.world.characters.values()) == 1
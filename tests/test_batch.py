@@ -0,0 +1,42 @@
+import asyncio
+import openai
+
+from ai.batch import BatchedPrompt
+from ai.prompt import OpenAIPrompt
+from world import Walk
+
+class Tokenizer:
+    def encode(self, text: str) -> list[str]:
+        return text.split()
+
+def test_batched_reevaluate(monkeypatch):
+    prompts = []
+
+    async def acreate(**kwargs):
+        content = kwargs["messages"][-1]["content"]
+        prompts.append(content)
+        if content.startswith("You are planning for"):
+            # Character 2 is left out, so it has to be reevaluated on its own
+            reply = "Character 1:\n1. Walk to key\n2. Pick up key\nCharacter 3:\n1. Open door with key"
+        else:
+            reply = "1. Walk to goal"
+        return {"choices": [{"message": {"role": "assistant", "content": reply}}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    prompt = OpenAIPrompt("key", "model", stream=False)
+    prompt.tokenizer = Tokenizer()
+    batched = BatchedPrompt(prompt, window=0.01)
+
+    async def run():
+        memory = prompt.executed(["Walk to door"], Walk("door"))
+        return await asyncio.gather(
+            batched.reevaluate(["There is a 'key' named 'key'."], memory, ["Walk to door"], "Win.", "Cannot reach 'door'"),
+            batched.reevaluate(["There is a 'goal' named 'goal'."], memory, [], "Win."),
+            batched.reevaluate(["There is a 'door' named 'door'."], memory, ["Open door", "Walk to goal"], "Win.", "You need a key"))
+    plans = asyncio.run(run())
+
+    assert plans == [["Walk to key", "Pick up key"], ["Walk to goal"], ["Open door with key"]]
+    assert len(prompts) == 2
+    batch = prompts[0]
+    assert "Character 3 has the final goal 'Win.'" in batch and "failed with the error: You need a key" in batch
+    assert "walk with the arguments" in batch and "There is a 'goal' named 'goal'." in batch
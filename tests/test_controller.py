@@ -0,0 +1,39 @@
+import asyncio
+
+from ai import AIController
+from ai.database import DumbDatabase
+from ai.prompt import Prompt
+from world import World
+
+class StuckPrompt(Prompt):
+    """Prompt which never comes up with a plan"""
+
+    def __init__(self):
+        self.cancelled = False
+
+    async def plan(self, context, inventory, goal, first_task=None):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+def test_close_cancels_pending_decision():
+    async def run():
+        prompt = StuckPrompt()
+        world = World((5, 5))
+        controller = AIController(DumbDatabase(), prompt, "Win.", [False])
+        world.add_character("red", controller, (0, 0))
+        await controller.db.fill(world)
+
+        world.tick(0.1)
+        await asyncio.sleep(0)
+        task = controller.next_action_task
+        assert task is not None and not task.done()
+
+        world.close()
+        await asyncio.sleep(0)
+        assert task.cancelled() and prompt.cancelled
+        assert controller.next_action_task is None
+
+    asyncio.run(run())
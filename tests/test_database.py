@@ -0,0 +1,73 @@
+import asyncio
+import openai
+import pytest
+import singlestoredb as s2
+import socket
+import tiktoken
+import time
+
+from ai.database import LocalDatabase, SingleStoreDatabase, stub_embed
+from interactions import Open, PickUp
+from world import World
+
+def offline(*args, **kwargs):
+    raise ConnectionError("No network access in tests")
+
+def test_local_database_with_stub_embed_offline(monkeypatch):
+    monkeypatch.setattr(socket, "create_connection", offline)
+    monkeypatch.setattr(tiktoken, "get_encoding", offline)
+    monkeypatch.setattr(openai.Embedding, "acreate", offline)
+
+    world = World((10, 10))
+    world.add_object_type("key", (1, 1), PickUp("key", "hand"), occlude=False)
+    world.add_object_type("door", (1, 2), Open("door", "key"))
+    world.add_object("key", "key", (1, 1))
+    world.add_object("door", "door", (5, 5))
+
+    db = LocalDatabase("cl100k_base", "text-embedding-ada-002", embed=stub_embed, limit=2)
+    asyncio.run(db.fill(world))
+    context = asyncio.run(db.query("Pick up the key"))
+    assert len(context) == 2
+    assert "There is a 'key' named 'key'." in context
+
+    # Changes to the world are embedded on the next query
+    world.remove_object("key")
+    assert "There is a 'key' named 'key'." not in asyncio.run(db.query("Pick up the key"))
+
+class SlowCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        time.sleep(0.2)
+
+    def executemany(self, query, rows):
+        time.sleep(0.2)
+
+    def fetchall(self):
+        return []
+
+class SlowConnection:
+    def cursor(self):
+        return SlowCursor()
+
+    def close(self):
+        pass
+
+def test_singlestore_timeout_only_applies_to_queries(monkeypatch):
+    monkeypatch.setattr(s2, "connect", lambda **kwargs: SlowConnection())
+    world = World((4, 4))
+    world.add_object_type("door", (1, 1), Open("door", "key"))
+    world.add_object("door", "door", (1, 1))
+
+    db = SingleStoreDatabase("cl100k_base", "model", "host", 0, "user", "password", "database", embed=stub_embed, timeout=0.1)
+
+    async def run():
+        # Filling resets the table and inserts the rows, which takes longer than a query may
+        await db.fill(world)
+        with pytest.raises(asyncio.TimeoutError):
+            await db.query("Open the door")
+    asyncio.run(run())
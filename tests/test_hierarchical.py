@@ -0,0 +1,87 @@
+import pytest
+import random
+
+from world import World, Interaction
+
+class Removeable(Interaction):
+    def __init__(self):
+        super().__init__(True)
+
+TYPES = {"door": (1, 1), "goal": (2, 2), "wall": (1, 3), "key": (1, 1)}
+
+def add_random_object(rng: random.Random, worlds: list[World], occupied: set[tuple[int, int]], name: str):
+    type = rng.choice(list(TYPES))
+    w, h = TYPES[type]
+    x, y = rng.randrange(worlds[0].size[0]), rng.randrange(worlds[0].size[1])
+    cells = {(i, j) for i in range(x, x + w) for j in range(y, y + h)}
+    if x + w > worlds[0].size[0] or y + h > worlds[0].size[1] or cells & occupied:
+        return
+    for world in worlds:
+        world.add_object(type, name, (x, y))
+    if type != "key":
+        occupied |= cells
+
+def cost(world: World, target: str, cell: tuple[int, int]) -> int:
+    """Cost of stepping into the given cell when walking to target"""
+    navigator = world.navigator
+    return navigator.step_cost(navigator.cells[cell[0] * world.size[1] + cell[1]], navigator.id_index.get(target, -1))
+
+@pytest.mark.parametrize("seed", range(40))
+def test_same_paths_as_flat(seed: int):
+    rng = random.Random(seed)
+    size = (rng.randint(8, 30), rng.randint(8, 30))
+    flat, hierarchical = World(size), World(size, hierarchical=True)
+    # Small clusters, so that paths cross several of them
+    hierarchical.navigator.hierarchy.cluster_size = rng.randint(2, 6)
+    worlds = [flat, hierarchical]
+
+    for world in worlds:
+        for type, area in TYPES.items():
+            world.add_object_type(type, area, Removeable(), occlude=type != "key")
+
+    occupied = set[tuple[int, int]]()
+    for _ in range(size[0] * size[1] // 3):
+        cell = (rng.randrange(size[0]), rng.randrange(size[1]))
+        if cell not in occupied:
+            occupied.add(cell)
+            for world in worlds:
+                world.make_impassable(cell + (1, 1))
+    for i in range(12):
+        add_random_object(rng, worlds, occupied, f"object{i}")
+
+    for round in range(4):
+        for _ in range(25):
+            if not flat.objects:
+                break
+            origin = (rng.randrange(size[0]), rng.randrange(size[1]))
+            target = rng.choice(list(flat.objects))
+            expected, result = flat.navigator.get_path(origin, target), hierarchical.navigator.get_path(origin, target)
+            assert isinstance(result, str) == isinstance(expected, str)
+            if not isinstance(result, str) and flat.objects[target].size == (1, 1):
+                # Larger targets can be entered at different points by equally short paths, which get_path cuts differently
+                assert len(result) == len(expected)
+
+            flat_path = flat.navigator.engine.search(origin, flat.objects[target].position, lambda x, y: cost(flat, target, (x, y)))
+            path = hierarchical.navigator.hierarchy.search(origin, flat.objects[target].position, hierarchical.navigator.seen_objects.get(target))
+            assert (path is None) == (flat_path is None)
+            if path is not None:
+                assert path[0] == origin and path[-1] == flat.objects[target].position
+                assert all(abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 for a, b in zip(path, path[1:]))
+                assert sum(cost(hierarchical, target, cell) for cell in path[1:]) == sum(cost(flat, target, cell) for cell in flat_path[1:])
+
+        # Changes between queries only invalidate the clusters they touch
+        for id in list(flat.objects):
+            if rng.random() < 0.3:
+                for world in worlds:
+                    world.remove_object(id)
+        for i in range(3):
+            add_random_object(rng, worlds, occupied, f"object{round}_{i}")
+
+def test_get_paths_builds_no_fields():
+    world = World((64, 64), hierarchical=True)
+    world.add_object_type("door", (1, 1), Removeable())
+    world.add_object("door", "door", (40, 40))
+
+    paths = world.navigator.get_paths([((0, 0), "door"), ((63, 0), "door")])
+    assert [len(path) for path in paths] == [80, 63]
+    assert not world.navigator.fields
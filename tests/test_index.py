@@ -0,0 +1,30 @@
+import asyncio
+import numpy as np
+
+from ai.database import LocalDatabase, stub_embed
+from ai.index import IVFIndex
+from world import World
+
+def world(objects: int) -> World:
+    world = World((objects, 1))
+    world.add_object_type("tree", (1, 1))
+    for i in range(objects):
+        world.add_object("tree", f"tree {i}", (i, 0))
+    return world
+
+def test_local_database_reuses_saved_index(tmp_path):
+    path = str(tmp_path / "ivf")
+    db = LocalDatabase("cl100k_base", "model", embed=stub_embed, index=IVFIndex(nlist=4, nprobe=4, train_size=20), index_path=path)
+    asyncio.run(db.fill(world(30)))
+    assert db.index is not None and db.index.trained
+
+    # The next run starts from the saved centroids, with only its own contexts in the index
+    db = LocalDatabase("cl100k_base", "model", embed=stub_embed, index=IVFIndex(nlist=4, nprobe=4, train_size=20), index_path=path)
+    assert db.index is not None and db.index.trained
+    centroids = db.index.centroids.copy()
+    asyncio.run(db.fill(world(25)))
+    assert len(db.index) == len(db.context) == 25
+    assert np.array_equal(db.index.centroids, centroids)
+
+    # Probing every list is exact
+    assert asyncio.run(db.query("Walk to tree 3"))[0] == "There is a 'tree' named 'tree 3'."
@@ -0,0 +1,16 @@
+from world import World
+from interactions import PickUp
+
+def test_get_paths_to_removed_object():
+    world = World((10, 10))
+    world.add_object_type("key", (1, 1), PickUp("key", "hand"), occlude=False)
+    world.add_object("key", "key", (5, 5))
+
+    # Walking to an interactable object keeps a distance field to it
+    assert isinstance(world.navigator.get_path((0, 0), "key"), list)
+    assert "key" in world.navigator.fields
+
+    # Picking the key up doesn't change occlusion, but the field must still go
+    world.remove_object("key")
+    assert "key" not in world.navigator.fields
+    assert world.navigator.get_paths([((0, 0), "key"), ((1, 1), "key")]) == ["No such object or character 'key'"] * 2
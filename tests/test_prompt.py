@@ -0,0 +1,54 @@
+import asyncio
+import openai
+import tiktoken
+
+from ai.cache import Cache
+from ai.prompt import OpenAIPrompt
+
+def fake_api(monkeypatch) -> list[dict]:
+    """Replaces the API with one which numbers its completions, and returns the requests made to it"""
+    requests = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        message = {"role": "assistant", "content": f"completion {len(requests)}"}
+        return {"choices": [{"message": message}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    return requests
+
+def complete(prompt: OpenAIPrompt, temperature: float = 0.5) -> str:
+    result = asyncio.run(prompt.completion(model="model", temperature=temperature, messages=[{"role": "system", "content": "Plan."}]))
+    return result["choices"][0]["message"]["content"]
+
+def test_sampled_completions_not_reused_by_default(monkeypatch):
+    requests = fake_api(monkeypatch)
+    prompt = OpenAIPrompt("key", "model", cache=Cache("completions"), stream=False)
+
+    assert complete(prompt) == "completion 1"
+    assert complete(prompt) == "completion 2"
+    assert complete(prompt, temperature=0) == "completion 3"
+    assert complete(prompt, temperature=0) == "completion 3"
+    assert len(requests) == 3
+
+def test_repeated_requests_get_new_samples(monkeypatch):
+    requests = fake_api(monkeypatch)
+    cache = Cache("completions")
+
+    # A repeated request, e.g. a reevaluate after the same error, isn't answered with the same plan again
+    prompt = OpenAIPrompt("key", "model", cache=cache, deterministic_cache=False, stream=False)
+    assert [complete(prompt), complete(prompt)] == ["completion 1", "completion 2"]
+
+    # The next run reuses the samples in the same order, and only asks for the ones it hasn't seen
+    prompt = OpenAIPrompt("key", "model", cache=cache, deterministic_cache=False, stream=False)
+    assert [complete(prompt), complete(prompt), complete(prompt)] == ["completion 1", "completion 2", "completion 3"]
+    assert len(requests) == 3
+
+def test_token_counts_estimated_without_encoding(monkeypatch):
+    def offline(*args):
+        raise ConnectionError("no network")
+    monkeypatch.setattr(tiktoken, "encoding_for_model", offline)
+    monkeypatch.setattr(tiktoken, "get_encoding", offline)
+    prompt = OpenAIPrompt("key", "model")
+
+    assert prompt.count_tokens("12345678") == 2
+    assert prompt.count_tokens("123456789") == 3